@@ -1,39 +1,76 @@
 from __future__ import annotations
 
-import random
-from typing import Tuple
+import functools
+import itertools
+import re
+from typing import Optional, Tuple
 
 from config import Settings
 
 
+_WORD_RE = re.compile(r"\S+")
+_DIAG_RE = re.compile(r"сильн|ок", re.IGNORECASE)
+# alternate the praise instead of drawing from the global RNG on every answer
+_GOOD_RESPONSES = itertools.cycle(
+    (
+        "Отлично: есть конкретика и фокус на действия. Давай двигаться дальше.",
+        "Хорошо сформулировано, видно рабочие шаги. Готов к следующему кейсу.",
+    )
+)
+
+
+def _more_words_than(text: str, limit: int) -> bool:
+    """Stop counting as soon as the limit is exceeded instead of splitting the whole text."""
+    count = 0
+    for _ in _WORD_RE.finditer(text):
+        count += 1
+        if count > limit:
+            return True
+    return False
+
+
+def has_fewer_words_than(text: str, limit: int) -> bool:
+    return not _more_words_than(text, limit - 1)
+
+
+@functools.lru_cache(maxsize=None)
+def _keyword_pattern(keywords: Tuple[str, ...]) -> Optional[re.Pattern[str]]:
+    """
+    One alternation over all keywords, compiled once per keyword set, so the
+    answer is scanned in a single pass. Longer keywords go first so that a
+    keyword is not shadowed by its own prefix.
+    """
+    words = sorted({kw.lower() for kw in keywords if kw}, key=len, reverse=True)
+    if not words:
+        return None
+    return re.compile("|".join(map(re.escape, words)), re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=4096)
+def _is_good_answer(text: str, keywords: Tuple[str, ...]) -> bool:
+    pattern = _keyword_pattern(keywords)
+    # only the matched fragments are lowercased, not the whole answer
+    score = len({m.lower() for m in pattern.findall(text)}) if pattern else 0
+    return score >= 2 or (score == 1 and _more_words_than(text, 12))
+
+
 def evaluate_answer(text: str, settings: Settings) -> Tuple[bool, str]:
     """
     Lightweight heuristic to simulate AI feedback.
     """
-    lower = text.lower()
-    score = 0
-    for kw in settings.ai_positive_keywords:
-        if kw in lower:
-            score += 1
-    score += int(len(text.split()) > 12)
-    good = score >= 2
-    if good:
-        return True, random.choice(
-            [
-                "Отлично: есть конкретика и фокус на действия. Давай двигаться дальше.",
-                "Хорошо сформулировано, видно рабочие шаги. Готов к следующему кейсу.",
-            ]
-        )
+    if _is_good_answer(text, tuple(settings.ai_positive_keywords)):
+        return True, next(_GOOD_RESPONSES)
     return (
         False,
         "Ответ пока поверхностный. Добавь конкретики: примеры, действия, ожидания. Попробуем ещё раз?",
     )
 
 
-def interpret_diagnostic(answers: list[str]) -> str:
+@functools.lru_cache(maxsize=4096)
+def interpret_diagnostic(answers: Tuple[str, ...]) -> str:
     if not answers:
         return "Диагностика не заполнена."
-    positives = sum(1 for a in answers if "сильн" in a.lower() or "ок" in a.lower())
+    positives = sum(1 for a in answers if _DIAG_RE.search(a))
     if positives >= len(answers) / 2:
         return "Уровень базовый/средний: есть сильные стороны, но стоит потренировать структурность."
     return "Диагностика показывает зоны роста: обратная связь пока размыта. Предлагаю начать с тренажёра и закрепить формат."
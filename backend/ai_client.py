@@ -1,25 +1,298 @@
 from __future__ import annotations
 
-import json
+import asyncio
+import contextlib
+import functools
+import gzip
+import hashlib
 import logging
-from typing import Any, Dict, List, Optional
+import re
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
 
 import httpx
+import msgspec
+import orjson
 
+from ai import has_fewer_words_than
+from cache import AnswerCache, ResponseCache, TTLCache
 from config import Settings
+from resilience import Bulkhead, CircuitBreaker, call_with_retries, retry_stream
+from schemas import (
+    DiagnosticResponse,
+    action_decoder,
+    cases_decoder,
+    diagnostic_decoder,
+    skill_eval_decoder,
+)
 
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+# Above this temperature answers are expected to vary, so they are never cached.
+CACHE_MAX_TEMPERATURE = 0.5
+MAX_PARALLEL_CASE_REQUESTS = 16
+MAX_ATTEMPTS = 3
+# answers below these word counts are scored without a call / by the cheap model
+TRIVIAL_ANSWER_WORDS = 5
+SHORT_ANSWER_WORDS = 20
+TRIVIAL_ANSWER_FEEDBACK = (
+    "Ответ слишком краткий, чтобы его оценить. Опишите, что конкретно вы бы сказали "
+    "и сделали в этой ситуации."
+)
+MAX_PARALLEL_WARMUPS = 8
+# a pre-generated set past this many TTLs is no longer served while it is
+# refreshed; the caller waits for a fresh one instead
+WARM_MAX_AGE_FACTOR = 4
+GZIP_MIN_BYTES = 4096
+_PROMPT_PLACEHOLDER = "\x00prompt\x00"
+_ACTIONS_KEY_RE = re.compile(r'"actions"\s*:\s*$')
+
+# Static across all build_actions calls so providers can reuse the cached prefix.
+_SYSTEM_PROMPT = (
+    "Ты тренер по навыкам обратной связи и ИПР. "
+    "Всегда отвечай JSON без текста вокруг. "
+    'Формат: {"actions":[{"type":"send_message","chat_id":<int>,"text":"...","parse_mode":"HTML","keyboard":{"inline":[[{"text":"...","data":"..."}]]}}]} '
+    "Текст должен быть кратким, на русском, без Markdown, только HTML (b, i, code, ul/li). "
+    "Если ответ ок — предложи кнопку 'Дальше' (data: case:next). "
+    "Если слабый — кнопка 'Попробовать снова' (data: case:retry) и короткая подсказка."
+)
+
+
+class _ActionStreamParser:
+    """
+    Incrementally extracts objects from the top-level "actions" array of a
+    JSON document that arrives in arbitrary text chunks.
+    """
+
+    def __init__(self) -> None:
+        self.text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._in_actions = False
+        self._start: Optional[int] = None
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        self.text += chunk
+        ready: List[Dict[str, Any]] = []
+        text = self.text
+        for i in range(self._pos, len(text)):
+            ch = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+            if ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                if (
+                    ch == "["
+                    and self._depth == 1
+                    and _ACTIONS_KEY_RE.search(text, 0, i)
+                ):
+                    self._in_actions = True
+                elif ch == "{" and self._in_actions and self._depth == 2:
+                    self._start = i
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._in_actions and self._depth == 2 and ch == "}" and self._start is not None:
+                    try:
+                        action = action_decoder.decode(text[self._start : i + 1])
+                        ready.append(msgspec.to_builtins(action))
+                    except msgspec.DecodeError:
+                        pass
+                    self._start = None
+                elif self._in_actions and self._depth == 1:
+                    self._in_actions = False
+        self._pos = len(text)
+        return ready
+
+
+def _chosen_idx(answer: str) -> Optional[int]:
+    """Option index from callback data like "diag:<question>:<option>"."""
+    tail = answer.rpartition(":")[2]
+    return int(tail) if tail.isdigit() else None
+
+
+def _diagnostic_line(idx: int, question: Dict[str, Any], answer: str) -> str:
+    opts = question.get("options") or []
+    chosen_idx = _chosen_idx(answer)
+    chosen = opts[chosen_idx] if chosen_idx is not None and chosen_idx < len(opts) else ""
+    return f"Q{idx+1}: {question.get('text')} | выбран: {chosen}"
+
+
+def make_ai_http_client() -> httpx.AsyncClient:
+    """
+    HTTP client tuned for the AI provider: HTTP/2 multiplexing and a warm
+    keep-alive pool, so concurrent calls share one TLS connection.
+    """
+    # limits/http2 must be set on the transport: the client ignores them
+    # when an explicit transport is passed.
+    transport = httpx.AsyncHTTPTransport(
+        http2=True,
+        retries=2,
+        limits=httpx.Limits(
+            max_connections=128, max_keepalive_connections=64, keepalive_expiry=60.0
+        ),
+    )
+    return httpx.AsyncClient(timeout=httpx.Timeout(30.0, connect=5.0), transport=transport)
+
 
 class AIClient:
-    def __init__(self, settings: Settings, client: httpx.AsyncClient):
+    def __init__(
+        self,
+        settings: Settings,
+        client: httpx.AsyncClient,
+        cache: Optional[ResponseCache] = None,
+    ):
         self.settings = settings
         self.client = client
+        self.cache = cache if cache is not None else TTLCache(settings.ai_cache_max_size)
+        self.answer_cache = AnswerCache(settings.ai_semantic_cache_size)
+        self.breaker = CircuitBreaker("openrouter")
+        self.bulkhead = Bulkhead(
+            "openrouter", settings.ai_max_concurrent_requests, settings.ai_queue_timeout_seconds
+        )
+        self._warm: OrderedDict[Tuple[str, str, str], Tuple[float, List[Any]]] = OrderedDict()
+        self._refreshing: set[Tuple[str, str, str]] = set()
+        self._background: set[asyncio.Task] = set()
+        self._headers_for: Optional[str] = None
+        self._cached_headers: Dict[str, str] = {}
+        self._actions_template_for: Optional[Tuple[str, float]] = None
+        self._actions_template: Tuple[bytes, bytes] = (b"", b"")
 
     def enabled(self) -> bool:
         return bool(self.settings.openrouter_api_key)
 
+    @staticmethod
+    def _cache_key(body: Dict[str, Any]) -> str:
+        raw = orjson.dumps(
+            {"m": body["model"], "t": body["temperature"], "msgs": body["messages"]},
+            option=orjson.OPT_SORT_KEYS,
+        )
+        return hashlib.sha256(raw).hexdigest()
+
+    async def _cached(
+        self, key: Optional[str], answer: Optional[Tuple[str, str]]
+    ) -> Optional[Any]:
+        """Cached content for `key`; None key means caching is off for this request."""
+        if key is None:
+            return None
+        cached = await self.cache.get(key)
+        if cached is None and answer is not None:
+            cached = self.answer_cache.get(*answer)
+        return cached
+
+    async def _remember(
+        self, key: Optional[str], answer: Optional[Tuple[str, str]], content: Any
+    ) -> None:
+        if key is None:
+            return
+        await self.cache.set(key, content, ttl=self.settings.ai_cache_ttl_seconds)
+        if answer is not None:
+            self.answer_cache.set(*answer, content)
+
+    def _headers(self) -> Dict[str, str]:
+        # built once per API key instead of on every request
+        api_key = self.settings.openrouter_api_key
+        if self._headers_for != api_key:
+            self._cached_headers = {
+                "Authorization": f"Bearer {api_key}",
+                "Content-Type": "application/json",
+            }
+            self._headers_for = api_key
+        return self._cached_headers
+
+    def _actions_payload(self, prompt: str) -> bytes:
+        """
+        Serialized streaming request body for build_actions. Everything except
+        the user prompt is serialized once per (model, temperature); per call
+        only the JSON-escaped prompt is spliced in.
+        """
+        settings_key = (self.settings.openrouter_model, self.settings.openrouter_temperature)
+        if self._actions_template_for != settings_key:
+            placeholder = orjson.dumps(_PROMPT_PLACEHOLDER)
+            template = orjson.dumps(
+                {
+                    "model": self.settings.openrouter_model,
+                    "messages": [
+                        self._system_message(_SYSTEM_PROMPT),
+                        {"role": "user", "content": _PROMPT_PLACEHOLDER},
+                    ],
+                    "temperature": self.settings.openrouter_temperature,
+                    "stream": True,
+                }
+            )
+            prefix, suffix = template.split(placeholder)
+            self._actions_template = (prefix, suffix)
+            self._actions_template_for = settings_key
+        prefix, suffix = self._actions_template
+        return prefix + orjson.dumps(prompt) + suffix
+
+    def _encode(self, content: bytes) -> Tuple[bytes, Dict[str, str]]:
+        """Request body and headers; large bodies are gzipped if the provider accepts it."""
+        headers = self._headers()
+        if self.settings.openrouter_gzip_requests and len(content) > GZIP_MIN_BYTES:
+            return gzip.compress(content, compresslevel=1), {**headers, "Content-Encoding": "gzip"}
+        return content, headers
+
+    async def _post(self, content: bytes) -> httpx.Response:
+        """
+        POST to the provider with a bounded timeout, retrying transport errors,
+        429 and 5xx with jittered backoff. Consecutive failures open the
+        circuit breaker so callers fall back immediately during an outage.
+        In-flight requests are capped by the bulkhead; when it stays full the
+        call is rejected and callers fall back as well.
+        """
+        content, headers = self._encode(content)
+
+        async def send() -> httpx.Response:
+            resp = await self.client.post(
+                self.settings.openrouter_base_url,
+                headers=headers,
+                content=content,
+                timeout=self.settings.openrouter_timeout_seconds,
+            )
+            resp.raise_for_status()
+            return resp
+
+        return await call_with_retries(self.breaker, MAX_ATTEMPTS, send, "AI request", self.bulkhead)
+
+    async def _complete(
+        self,
+        body: Dict[str, Any],
+        parse: Callable[[str], T],
+        answer: Optional[Tuple[str, str]] = None,
+    ) -> T:
+        """
+        POST a chat completion and parse its content.
+        Responses are served from cache for low-temperature requests; a response
+        is only stored once `parse` accepts it.
+        `answer` is (bucket, user answer) for lookups that ignore case and
+        punctuation in the answer.
+        """
+        key = self._cache_key(body) if body["temperature"] <= CACHE_MAX_TEMPERATURE else None
+        cached = await self._cached(key, answer)
+        if cached is not None:
+            return parse(cached)
+
+        resp = await self._post(orjson.dumps(body))
+        data = orjson.loads(resp.content)
+        content = data["choices"][0]["message"]["content"]
+        result = parse(content)
+        await self._remember(key, answer, content)
+        return result
+
     async def build_actions(
         self,
         skill: str,
@@ -30,49 +303,99 @@ class AIClient:
         """
         Ask the model to score the answer and return JSON actions.
         """
+        actions = [
+            act
+            async for act in self.stream_actions(
+                skill=skill, case_text=case_text, user_answer=user_answer, sphere=sphere
+            )
+        ]
+        if not actions:
+            raise RuntimeError("AI response is not valid JSON or empty")
+        return actions
+
+    async def stream_actions(
+        self,
+        skill: str,
+        case_text: str,
+        user_answer: str,
+        sphere: str,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Streaming variant of build_actions: each action is yielded as soon as
+        its JSON object is complete in the model output.
+        """
         if not self.enabled():
             raise RuntimeError("OpenRouter API key not configured")
 
         prompt = self._prompt(skill=skill, sphere=sphere, case_text=case_text, user_answer=user_answer)
-        headers = {
-            "Authorization": f"Bearer {self.settings.openrouter_api_key}",
-            "Content-Type": "application/json",
-        }
-        body = {
-            "model": self.settings.openrouter_model,
-            "messages": [
-                {
-                    "role": "system",
-                    "content": (
-                        "Ты тренер по навыкам обратной связи и ИПР. "
-                        "Всегда отвечай JSON без текста вокруг. "
-                        'Формат: {"actions":[{"type":"send_message","chat_id":<int>,"text":"...","parse_mode":"HTML","keyboard":{"inline":[[{"text":"...","data":"..."}]]}}]} '
-                        "Текст должен быть кратким, на русском, без Markdown, только HTML (b, i, code, ul/li). "
-                        "Если ответ ок — предложи кнопку 'Дальше' (data: case:next). "
-                        "Если слабый — кнопка 'Попробовать снова' (data: case:retry) и короткая подсказка."
-                    ),
-                },
-                {
-                    "role": "user",
-                    "content": prompt,
-                },
-            ],
-            "temperature": self.settings.openrouter_temperature,
-        }
-        resp = await self.client.post(
-            self.settings.openrouter_base_url, headers=headers, json=body
+        payload = self._actions_payload(prompt)
+        answer = (
+            AnswerCache.bucket_key("actions", self.settings.openrouter_model, skill, sphere, case_text),
+            user_answer,
         )
-        resp.raise_for_status()
-        data = resp.json()
-        content = data["choices"][0]["message"]["content"]
+        key = None
+        if self.settings.openrouter_temperature <= CACHE_MAX_TEMPERATURE:
+            # the payload embeds model, temperature and messages, so it is a valid key
+            key = hashlib.sha256(payload).hexdigest()
+        cached = await self._cached(key, answer)
+        if cached is not None:
+            for act in _ActionStreamParser().feed(cached):
+                yield act
+            return
+
+        body, headers = self._encode(payload)
+        parser = _ActionStreamParser()
+        plain: List[str] = []
+
+        async def stream() -> AsyncIterator[Dict[str, Any]]:
+            # every attempt starts from scratch
+            nonlocal parser, plain
+            parser = _ActionStreamParser()
+            plain = []
+            async with self.client.stream(
+                "POST",
+                self.settings.openrouter_base_url,
+                headers=headers,
+                content=body,
+                timeout=self.settings.openrouter_timeout_seconds,
+            ) as resp:
+                resp.raise_for_status()
+                async for line in resp.aiter_lines():
+                    if not line.startswith("data:"):
+                        # SSE comments/blank lines, or a provider that ignored "stream"
+                        if line and not line.startswith(":"):
+                            plain.append(line)
+                        continue
+                    chunk = line[5:].strip()
+                    if chunk == "[DONE]":
+                        break
+                    try:
+                        delta = orjson.loads(chunk)["choices"][0].get("delta") or {}
+                    except (ValueError, KeyError, IndexError):
+                        continue
+                    for act in parser.feed(delta.get("content") or ""):
+                        yield act
+
+        found = 0
+        async with contextlib.aclosing(
+            retry_stream(self.breaker, MAX_ATTEMPTS, stream, "AI stream", self.bulkhead)
+        ) as actions:
+            async for act in actions:
+                found += 1
+                yield act
+        if not parser.text and plain:
+            try:
+                message = orjson.loads("\n".join(plain))["choices"][0]["message"]["content"]
+            except (ValueError, KeyError, IndexError):
+                message = ""
+            for act in parser.feed(message):
+                found += 1
+                yield act
+        content = parser.text
         logger.info("AI raw content: %s", content)
-        try:
-            actions = json.loads(content).get("actions", [])
-            if not actions:
-                raise RuntimeError("empty actions")
-            return actions
-        except Exception as exc:  # noqa: BLE001
-            raise RuntimeError(f"AI response is not valid JSON or empty: {content}") from exc
+        if not found:
+            raise RuntimeError(f"AI response is not valid JSON or empty: {content}")
+        await self._remember(key, answer, content)
 
     async def generate_diagnostic(
         self,
@@ -92,64 +415,165 @@ class AIClient:
             f"Каждый вопрос должен иметь ровно {options_per_question} варианта ответа. "
             "Кратко, по-деловому, на русском."
         )
-        headers = {
-            "Authorization": f"Bearer {self.settings.openrouter_api_key}",
-            "Content-Type": "application/json",
-        }
         body = {
             "model": self.settings.openrouter_model,
             "messages": [{"role": "user", "content": prompt}],
             "temperature": self.settings.openrouter_temperature,
         }
-        resp = await self.client.post(self.settings.openrouter_base_url, headers=headers, json=body)
-        resp.raise_for_status()
-        data = resp.json()
-        content = data["choices"][0]["message"]["content"]
-        try:
-            # some providers may already return dict instead of string
-            parsed = json.loads(content) if isinstance(content, str) else content
-            questions = parsed.get("questions", []) if isinstance(parsed, dict) else []
-            # normalize
-            result = []
-            for q in questions:
-                question_text = str(q.get("question") or "").strip()
-                opts = q.get("options") or []
-                opts = [str(o).strip() for o in opts if str(o).strip()]
-                if not question_text or not opts:
-                    continue
-                result.append({"text": question_text, "options": opts[:options_per_question]})
-            return result[:num_questions]
-        except Exception as exc:  # noqa: BLE001
-            raise RuntimeError(f"AI diagnostic response invalid: {content}") from exc
+
+        def parse(content: Any) -> List[Dict[str, Any]]:
+            try:
+                # some providers may already return dict instead of string
+                if isinstance(content, str):
+                    parsed = diagnostic_decoder.decode(content)
+                else:
+                    parsed = msgspec.convert(content, DiagnosticResponse)
+                # normalize
+                result = []
+                for q in parsed.questions:
+                    question_text = q.question.strip()
+                    opts = [o.strip() for o in q.options if o.strip()]
+                    if not question_text or not opts:
+                        continue
+                    result.append({"text": question_text, "options": opts[:options_per_question]})
+                return result[:num_questions]
+            except Exception as exc:  # noqa: BLE001
+                raise RuntimeError(f"AI diagnostic response invalid: {content}") from exc
+
+        return await self._complete(body, parse)
 
     async def generate_cases(self, skill: str, sphere: str, num_cases: int = 10) -> List[str]:
+        """
+        Generate training cases. When `ai_cases_per_request` is below
+        `num_cases` the set is split into batches that are requested
+        concurrently, so latency is bounded by the slowest batch instead of
+        the whole set. Fails unless all `num_cases` cases come back: a short
+        set would run out mid-training and is cached per (skill, sphere).
+        """
         if not self.enabled():
             raise RuntimeError("OpenRouter API key not configured")
+        per_request = max(1, self.settings.ai_cases_per_request)
+        sizes = [min(per_request, num_cases - start) for start in range(0, num_cases, per_request)]
+        semaphore = asyncio.Semaphore(MAX_PARALLEL_CASE_REQUESTS)
+
+        async def run(part: int, size: int) -> List[str]:
+            async with semaphore:
+                return await self._generate_case_batch(skill, sphere, size, part, len(sizes))
+
+        results = await asyncio.gather(
+            *(run(part, size) for part, size in enumerate(sizes)), return_exceptions=True
+        )
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            logger.warning("AI cases: %s of %s batches failed: %s", len(errors), len(sizes), errors[0])
+            raise errors[0]
+        cases = [case for batch in results for case in batch]
+        if len(cases) < num_cases:
+            raise RuntimeError(f"AI returned {len(cases)} of {num_cases} cases")
+        return cases[:num_cases]
+
+    async def _generate_case_batch(
+        self, skill: str, sphere: str, num_cases: int, part: int, parts: int
+    ) -> List[str]:
         prompt = (
             f"Сформулируй {num_cases} кейсов-вопросов для тренажёра навыка '{skill}' в сфере '{sphere}'. "
             "Каждый кейс — это реалистичная рабочая ситуация с вопросом к пользователю. "
             "Формат кейса: описание ситуации (2-3 предложения) + вопрос 'Как ты поступишь?' или аналогичный. "
             "Кейсы должны быть разнообразными, с нарастающей сложностью. "
-            f"Ответ верни строгим JSON: {{\"cases\": [\"кейс1\", \"кейс2\", ..., \"кейс{num_cases}\"]}} без пояснений."
         )
-        headers = {
-            "Authorization": f"Bearer {self.settings.openrouter_api_key}",
-            "Content-Type": "application/json",
-        }
+        if parts > 1:
+            prompt += (
+                f"Это часть {part + 1} из {parts} общего набора: уровень сложности {part + 1} из {parts}, "
+                "не используй типовые ситуации, подходящие для других уровней. "
+            )
+        prompt += f"Ответ верни строгим JSON: {{\"cases\": [\"кейс1\", \"кейс2\", ..., \"кейс{num_cases}\"]}} без пояснений."
         body = {
             "model": self.settings.openrouter_model,
             "messages": [{"role": "user", "content": prompt}],
             "temperature": self.settings.openrouter_temperature,
         }
-        resp = await self.client.post(self.settings.openrouter_base_url, headers=headers, json=body)
-        resp.raise_for_status()
-        data = resp.json()
-        content = data["choices"][0]["message"]["content"]
+
+        def parse(content: str) -> List[str]:
+            try:
+                cases = cases_decoder.decode(content).cases
+                return [c.strip() for c in cases if c.strip()][:num_cases]
+            except Exception as exc:  # noqa: BLE001
+                raise RuntimeError(f"AI cases response invalid: {content}") from exc
+
+        return await self._complete(body, parse)
+
+    def _warm_enabled(self) -> bool:
+        # pre-generated sets are kept only with warm-up on and the AI cache not disabled
+        return self.settings.ai_warmup_interval_seconds > 0 and self.settings.ai_cache_max_size > 0
+
+    async def cached_cases(self, skill: str, sphere: str) -> List[str]:
+        """generate_cases, served stale-while-revalidate from the warm-up set."""
+        return await self._stale_while_revalidate(
+            ("cases", skill, sphere), lambda: self.generate_cases(skill=skill, sphere=sphere)
+        )
+
+    async def cached_diagnostic(self, sphere: str, skill: str) -> List[Dict[str, Any]]:
+        """generate_diagnostic, served stale-while-revalidate from the warm-up set."""
+        return await self._stale_while_revalidate(
+            ("diagnostic", skill, sphere),
+            lambda: self.generate_diagnostic(sphere=sphere, skill=skill),
+        )
+
+    async def warm(self, pairs: List[Tuple[str, str]]) -> None:
+        """Pre-generate cases and diagnostics for (skill, sphere) pairs."""
+        if not self._warm_enabled():
+            return
+        semaphore = asyncio.Semaphore(MAX_PARALLEL_WARMUPS)
+
+        async def run(key: Tuple[str, str, str], fetch: Callable[[], Awaitable[List[Any]]]) -> None:
+            async with semaphore:
+                await self._refresh(key, fetch)
+
+        jobs = []
+        for skill, sphere in pairs:
+            cases = functools.partial(self.generate_cases, skill=skill, sphere=sphere)
+            diagnostic = functools.partial(self.generate_diagnostic, sphere=sphere, skill=skill)
+            jobs.append(run(("cases", skill, sphere), cases))
+            jobs.append(run(("diagnostic", skill, sphere), diagnostic))
+        await asyncio.gather(*jobs)
+
+    async def _stale_while_revalidate(
+        self, key: Tuple[str, str, str], fetch: Callable[[], Awaitable[List[Any]]]
+    ) -> List[Any]:
+        if not self._warm_enabled():
+            return await fetch()
+        ttl = self.settings.ai_cache_ttl_seconds
+        entry = self._warm.get(key)
+        if entry is None or time.monotonic() - entry[0] > ttl * WARM_MAX_AGE_FACTOR:
+            value = await fetch()
+            self._store_warm(key, value)
+            return list(value)
+        fetched_at, value = entry
+        self._warm.move_to_end(key)
+        if time.monotonic() - fetched_at > ttl and key not in self._refreshing:
+            task = asyncio.create_task(self._refresh(key, fetch))
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+        return list(value)
+
+    async def _refresh(self, key: Tuple[str, str, str], fetch: Callable[[], Awaitable[List[Any]]]) -> None:
+        if key in self._refreshing:
+            return
+        self._refreshing.add(key)
         try:
-            cases = json.loads(content).get("cases", [])
-            return [str(c).strip() for c in cases if str(c).strip()][:10]
+            self._store_warm(key, await fetch())
         except Exception as exc:  # noqa: BLE001
-            raise RuntimeError(f"AI cases response invalid: {content}") from exc
+            logger.warning("AI warm-up for %s failed, keeping stale value: %s", key, exc)
+        finally:
+            self._refreshing.discard(key)
+
+    def _store_warm(self, key: Tuple[str, str, str], value: List[Any]) -> None:
+        if not value or not self._warm_enabled():
+            return
+        self._warm[key] = (time.monotonic(), value)
+        self._warm.move_to_end(key)
+        while len(self._warm) > self.settings.ai_cache_max_size:
+            self._warm.popitem(last=False)
 
     async def summarize_diagnostic(
         self,
@@ -160,48 +584,47 @@ class AIClient:
     ) -> str:
         if not self.enabled():
             raise RuntimeError("OpenRouter API key not configured")
-        q_lines = []
-        for idx, q in enumerate(questions):
-            opts = q.get("options") or []
-            chosen_idx = None
-            if idx < len(answers):
-                try:
-                    parts = answers[idx].split(":")
-                    chosen_idx = int(parts[-1])
-                except Exception:
-                    chosen_idx = None
-            chosen = opts[chosen_idx] if chosen_idx is not None and chosen_idx < len(opts) else ""
-            q_lines.append(f"Q{idx+1}: {q.get('text')} | выбран: {chosen}")
+        padded = answers + [""] * (len(questions) - len(answers))
+        q_lines = "\n".join(
+            _diagnostic_line(idx, q, answer) for idx, (q, answer) in enumerate(zip(questions, padded))
+        )
         prompt = (
             "Подведи итоги диагностики.\n"
             f"Сфера: {sphere}\nНавык/тематика: {skill}\n"
-            "Вопросы и выбранные ответы:\n" + "\n".join(q_lines) + "\n"
+            "Вопросы и выбранные ответы:\n" + q_lines + "\n"
             "Сформулируй краткий вывод и совет следующего шага. Ответ верни текстом на русском, 1-2 абзаца."
         )
-        headers = {
-            "Authorization": f"Bearer {self.settings.openrouter_api_key}",
-            "Content-Type": "application/json",
-        }
         body = {
             "model": self.settings.openrouter_model,
             "messages": [{"role": "user", "content": prompt}],
             "temperature": self.settings.openrouter_temperature,
         }
-        resp = await self.client.post(self.settings.openrouter_base_url, headers=headers, json=body)
-        resp.raise_for_status()
-        data = resp.json()
-        content = data["choices"][0]["message"]["content"]
-        return str(content).strip()
+        return await self._complete(body, lambda content: str(content).strip())
 
     def _prompt(self, skill: str, sphere: str, case_text: str, user_answer: str) -> str:
+        # fixed instruction first, variable parts last: keeps the cacheable prefix identical
         return (
+            "Оцени ответ и верни JSON с действиями (см. формат).\n"
             f"Сфера: {sphere}\n"
             f"Навык: {skill}\n"
             f"Кейс: {case_text}\n"
-            f"Ответ пользователя: {user_answer}\n"
-            "Оцени ответ и верни JSON с действиями (см. формат)."
+            f"Ответ пользователя: {user_answer}"
         )
 
+    def _system_message(self, text: str) -> Dict[str, Any]:
+        """
+        OpenAI-compatible providers cache identical prompt prefixes automatically;
+        Anthropic models need an explicit cache breakpoint on the static block.
+        """
+        if self.settings.openrouter_model.startswith("anthropic/"):
+            return {
+                "role": "system",
+                "content": [
+                    {"type": "text", "text": text, "cache_control": {"type": "ephemeral"}}
+                ],
+            }
+        return {"role": "system", "content": text}
+
     async def generate_skill_situation(
         self,
         skill_name: str,
@@ -225,20 +648,12 @@ class AIClient:
             "Верни только текст ситуации, без JSON и пояснений."
         )
         
-        headers = {
-            "Authorization": f"Bearer {self.settings.openrouter_api_key}",
-            "Content-Type": "application/json",
-        }
         body = {
             "model": self.settings.openrouter_model,
             "messages": [{"role": "user", "content": prompt}],
             "temperature": 0.7,
         }
-        resp = await self.client.post(self.settings.openrouter_base_url, headers=headers, json=body)
-        resp.raise_for_status()
-        data = resp.json()
-        content = data["choices"][0]["message"]["content"]
-        return str(content).strip()
+        return await self._complete(body, lambda content: str(content).strip())
 
     async def evaluate_skill_answer(
         self,
@@ -248,9 +663,20 @@ class AIClient:
         user_answer: str,
         theory_doc: str = ""
     ) -> Dict[str, Any]:
-        """Evaluate user's answer to a skill training situation."""
+        """
+        Evaluate user's answer to a skill training situation.
+        Near-empty answers are scored locally; short ones go to the cheap
+        model when one is configured.
+        """
         if not self.enabled():
             raise RuntimeError("OpenRouter API key not configured")
+        if has_fewer_words_than(user_answer, TRIVIAL_ANSWER_WORDS):
+            return {"score": 2, "feedback": TRIVIAL_ANSWER_FEEDBACK}
+        model = self.settings.openrouter_model
+        if self.settings.openrouter_cheap_model and has_fewer_words_than(
+            user_answer, SHORT_ANSWER_WORDS
+        ):
+            model = self.settings.openrouter_cheap_model
         
         prompt = (
             f"Оцени ответ пользователя на тренировочную ситуацию.\n\n"
@@ -271,29 +697,25 @@ class AIClient:
             'Верни строго JSON: {"score": <число 1-10>, "feedback": "<текст обратной связи>"}'
         )
         
-        headers = {
-            "Authorization": f"Bearer {self.settings.openrouter_api_key}",
-            "Content-Type": "application/json",
-        }
         body = {
-            "model": self.settings.openrouter_model,
+            "model": model,
             "messages": [{"role": "user", "content": prompt}],
             "temperature": 0.3,
         }
-        resp = await self.client.post(self.settings.openrouter_base_url, headers=headers, json=body)
-        resp.raise_for_status()
-        data = resp.json()
-        content = data["choices"][0]["message"]["content"]
-        
-        try:
-            result = json.loads(content)
-            return {
-                "score": int(result.get("score", 5)),
-                "feedback": str(result.get("feedback", "Спасибо за ответ."))
-            }
-        except Exception:
-            # If JSON parsing fails, extract what we can
-            return {
-                "score": 5,
-                "feedback": content if len(content) < 1000 else content[:1000]
-            }
+
+        def parse(content: str) -> Dict[str, Any]:
+            try:
+                result = skill_eval_decoder.decode(content)
+                return {"score": int(result.score), "feedback": result.feedback}
+            except Exception:
+                # If JSON parsing fails, extract what we can
+                return {
+                    "score": 5,
+                    "feedback": content if len(content) < 1000 else content[:1000]
+                }
+
+        answer = (
+            AnswerCache.bucket_key("evaluate", body["model"], skill_name, situation),
+            user_answer,
+        )
+        return await self._complete(body, parse, answer)
@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Protocol
+
+
+class ResponseCache(Protocol):
+    async def get(self, key: str) -> Optional[Any]:
+        ...
+
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        ...
+
+
+class TTLCache:
+    """In-process LRU cache with per-entry expiry."""
+
+    def __init__(self, maxsize: int = 2048) -> None:
+        self.maxsize = maxsize
+        self._data: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._lock = asyncio.Lock()
+
+    async def get(self, key: str) -> Optional[Any]:
+        async with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        if self.maxsize <= 0 or ttl <= 0:
+            return
+        async with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase word sequence; case, punctuation and spacing are ignored."""
+    return " ".join(_WORD_RE.findall(text.lower().replace("ё", "е")))
+
+
+class AnswerCache:
+    """
+    Responses to the same answer: entries are grouped into buckets (e.g. one
+    per case) and keyed by the normalized answer text. Only answers with the
+    same words in the same order match; anything else, including a single
+    added "не", is a miss.
+    """
+
+    def __init__(self, max_per_bucket: int = 64, max_buckets: int = 1024) -> None:
+        self.max_per_bucket = max_per_bucket
+        self.max_buckets = max_buckets
+        self._buckets: OrderedDict[str, OrderedDict[str, Any]] = OrderedDict()
+
+    @staticmethod
+    def bucket_key(*parts: str) -> str:
+        return hashlib.sha256("\x1f".join(parts).encode()).hexdigest()
+
+    def get(self, bucket: str, text: str) -> Optional[Any]:
+        entries = self._buckets.get(bucket)
+        if not entries:
+            return None
+        key = normalize_text(text)
+        if key not in entries:
+            return None
+        self._buckets.move_to_end(bucket)
+        entries.move_to_end(key)
+        return entries[key]
+
+    def set(self, bucket: str, text: str, value: Any) -> None:
+        if self.max_per_bucket <= 0:
+            return
+        key = normalize_text(text)
+        if not key:
+            return
+        entries = self._buckets.setdefault(bucket, OrderedDict())
+        self._buckets.move_to_end(bucket)
+        entries[key] = value
+        entries.move_to_end(key)
+        while len(entries) > self.max_per_bucket:
+            entries.popitem(last=False)
+        while len(self._buckets) > self.max_buckets:
+            self._buckets.popitem(last=False)
@@ -1,3 +1,4 @@
+import functools
 import os
 from dataclasses import dataclass, field
 
@@ -30,6 +31,9 @@ class Settings:
     openrouter_model: str = field(
         default_factory=lambda: _getenv("OPENROUTER_MODEL") or "gpt-3.5-turbo"
     )
+    openrouter_cheap_model: str | None = field(
+        default_factory=lambda: _getenv("OPENROUTER_CHEAP_MODEL") or None
+    )
     openrouter_base_url: str = field(
         default_factory=lambda: _getenv("OPENROUTER_BASE_URL")
         or "https://api.openai.com/v1/chat/completions"
@@ -37,6 +41,33 @@ class Settings:
     openrouter_temperature: float = field(
         default_factory=lambda: float(_getenv("OPENROUTER_TEMPERATURE") or 0.2)
     )
+    openrouter_gzip_requests: bool = field(
+        default_factory=lambda: _getenv("OPENROUTER_GZIP_REQUESTS").lower() in ("1", "true", "yes")
+    )
+    openrouter_timeout_seconds: float = field(
+        default_factory=lambda: float(_getenv("OPENROUTER_TIMEOUT_SECONDS") or 15.0)
+    )
+    ai_cache_ttl_seconds: float = field(
+        default_factory=lambda: float(_getenv("AI_CACHE_TTL_SECONDS") or 3600)
+    )
+    ai_cache_max_size: int = field(
+        default_factory=lambda: int(_getenv("AI_CACHE_MAX_SIZE") or 2048)
+    )
+    ai_semantic_cache_size: int = field(
+        default_factory=lambda: int(_getenv("AI_SEMANTIC_CACHE_SIZE") or 64)
+    )
+    ai_cases_per_request: int = field(
+        default_factory=lambda: int(_getenv("AI_CASES_PER_REQUEST") or 10)
+    )
+    ai_warmup_interval_seconds: float = field(
+        default_factory=lambda: float(_getenv("AI_WARMUP_INTERVAL_SECONDS") or 0)
+    )
+    ai_max_concurrent_requests: int = field(
+        default_factory=lambda: int(_getenv("AI_MAX_CONCURRENT_REQUESTS") or 64)
+    )
+    ai_queue_timeout_seconds: float = field(
+        default_factory=lambda: float(_getenv("AI_QUEUE_TIMEOUT_SECONDS") or 0.5)
+    )
     ai_positive_keywords: tuple[str, ...] = (
         "конструктив",
         "конкретно",
@@ -44,3 +75,9 @@ class Settings:
         "пример",
         "ожидания",
     )
+
+
+@functools.lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Settings are read from the environment once per process."""
+    return Settings()
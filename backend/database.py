@@ -1,26 +1,220 @@
 from __future__ import annotations
 
-import sqlite3
-import json
+import atexit
 import logging
+import queue
+import sqlite3
+import threading
 from datetime import datetime
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple, TypeVar
+from collections import OrderedDict, deque
+from concurrent.futures import Future
 from contextlib import contextmanager
+from dataclasses import dataclass
+from itertools import islice
+
+import orjson
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
 DATABASE_PATH = "conversations.db"
+# messages live in their own file, attached to every connection as `mdb`, so
+# their churn, WAL and checkpoints stay away from the low-churn tables
+MESSAGES_DATABASE_PATH = "messages.db"
+STATEMENT_CACHE_SIZE = 256
+# bump when init_db changes the schema
+SCHEMA_VERSION = 4
+# ALTER TABLE ... DROP COLUMN needs SQLite 3.35+
+_HAS_DROP_COLUMN = sqlite3.sqlite_version_info >= (3, 35, 0)
+# INSERT ... RETURNING needs SQLite 3.35+
+_HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+
+# journal_mode is persisted in the database file, so it is set once per path
+_wal_paths: set[str] = set()
 
 
-def get_connection() -> sqlite3.Connection:
-    conn = sqlite3.connect(DATABASE_PATH, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
+def get_connection(
+    check_same_thread: bool = True, row_factory: Optional[Callable] = sqlite3.Row
+) -> sqlite3.Connection:
+    conn = sqlite3.connect(
+        DATABASE_PATH, check_same_thread=check_same_thread, cached_statements=STATEMENT_CACHE_SIZE
+    )
+    conn.row_factory = row_factory
+    conn.execute("ATTACH DATABASE ? AS mdb", (MESSAGES_DATABASE_PATH,))
+    for schema, path in (("main", DATABASE_PATH), ("mdb", MESSAGES_DATABASE_PATH)):
+        if path not in _wal_paths:
+            conn.execute(f"PRAGMA {schema}.journal_mode=WAL")
+            _wal_paths.add(path)
+        # WAL + NORMAL: commits append to the log instead of fsyncing the main file
+        conn.execute(f"PRAGMA {schema}.synchronous=NORMAL")
+        conn.execute(f"PRAGMA {schema}.cache_size=-64000")
+        conn.execute(f"PRAGMA {schema}.mmap_size=268435456")
+        conn.execute(f"PRAGMA {schema}.cache_spill=OFF")
+        # truncate the WAL back to 64 MB after checkpoints instead of letting it grow
+        conn.execute(f"PRAGMA {schema}.journal_size_limit=67108864")
+    # per connection; each file's WAL is checkpointed on its own
+    conn.execute("PRAGMA wal_autocheckpoint=1000")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    # wait for a competing writer inside SQLite rather than failing with SQLITE_BUSY
+    conn.execute("PRAGMA busy_timeout=5000")
     return conn
 
 
+READ_POOL_SIZE = 4
+FETCH_SIZE = 256
+WRITE_BATCH_SIZE = 64
+
+# Connections live for the whole process: a small pool for reads and one
+# writer thread that owns the only write connection.
+_read_pool: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+_readers: List[sqlite3.Connection] = []
+_pool_lock = threading.Lock()
+_write_queue: "queue.Queue[Optional[Tuple[Callable[[sqlite3.Connection], Any], Future, bool]]]" = queue.Queue()
+_writer_thread: Optional[threading.Thread] = None
+_writer_lock = threading.Lock()
+
+
+def _acquire_reader() -> sqlite3.Connection:
+    try:
+        return _read_pool.get_nowait()
+    except queue.Empty:
+        pass
+    with _pool_lock:
+        if len(_readers) < READ_POOL_SIZE:
+            # pooled readers are handed to whichever thread asks for one;
+            # they return plain tuples, see _dicts()
+            conn = get_connection(check_same_thread=False, row_factory=None)
+            _readers.append(conn)
+            return conn
+    return _read_pool.get()
+
+
+def _write(fn: Callable[[sqlite3.Connection], T], own_transaction: bool = False) -> T:
+    """
+    Run fn(conn) on the writer thread and wait until it is committed.
+    Jobs queued together share one transaction, each in its own savepoint;
+    own_transaction jobs (e.g. executescript) run outside of it.
+    """
+    global _writer_thread
+    with _writer_lock:
+        if _writer_thread is None:
+            _writer_thread = threading.Thread(target=_writer_loop, name="sqlite-writer", daemon=True)
+            _writer_thread.start()
+    future: Future = Future()
+    _write_queue.put((fn, future, own_transaction))
+    return future.result()
+
+
+def _writer_loop() -> None:
+    conn = get_connection()
+    # transactions are managed explicitly below
+    conn.isolation_level = None
+    while True:
+        jobs = [_write_queue.get()]
+        # group-commit whatever is already queued; callers block on their
+        # futures, so waiting for more work would only add latency
+        while len(jobs) < WRITE_BATCH_SIZE and jobs[-1] is not None:
+            try:
+                jobs.append(_write_queue.get_nowait())
+            except queue.Empty:
+                break
+        stop = jobs[-1] is None
+        batch: List[Tuple[Callable[[sqlite3.Connection], Any], Future]] = []
+        for job in jobs:
+            if job is None:
+                continue
+            fn, future, own_transaction = job
+            if not own_transaction:
+                batch.append((fn, future))
+                continue
+            _commit_batch(conn, batch)
+            batch = []
+            try:
+                future.set_result(fn(conn))
+            except Exception as exc:  # noqa: BLE001
+                future.set_exception(exc)
+        _commit_batch(conn, batch)
+        if stop:
+            break
+    # refresh planner statistics (runs ANALYZE only where it is stale)
+    conn.execute("PRAGMA optimize")
+    conn.close()
+
+
+def _commit_batch(
+    conn: sqlite3.Connection, batch: List[Tuple[Callable[[sqlite3.Connection], Any], Future]]
+) -> None:
+    if not batch:
+        return
+    outcomes = []
+    try:
+        # take the write lock up front instead of upgrading a deferred transaction
+        conn.execute("BEGIN IMMEDIATE")
+        for fn, future in batch:
+            conn.execute("SAVEPOINT job")
+            try:
+                result = fn(conn)
+            except Exception as exc:  # noqa: BLE001
+                # a failing job only undoes its own changes
+                conn.execute("ROLLBACK TO job")
+                conn.execute("RELEASE job")
+                outcomes.append((future, exc, None))
+                continue
+            conn.execute("RELEASE job")
+            outcomes.append((future, None, result))
+        conn.execute("COMMIT")
+    except Exception as exc:  # noqa: BLE001
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        for _, future in batch:
+            future.set_exception(exc)
+        return
+    for future, exc, result in outcomes:
+        if exc is not None:
+            future.set_exception(exc)
+        else:
+            future.set_result(result)
+
+
+@atexit.register
+def close_connections() -> None:
+    global _writer_thread
+    flush_messages()
+    flush_progress()
+    with _writer_lock:
+        if _writer_thread is not None:
+            _write_queue.put(None)
+            _writer_thread.join(timeout=5)
+            _writer_thread = None
+    with _pool_lock:
+        while not _read_pool.empty():
+            _read_pool.get_nowait()
+        for conn in _readers:
+            conn.close()
+        _readers.clear()
+
+
+def _dicts(cursor: sqlite3.Cursor, rows: Optional[List[tuple]] = None) -> List[Dict[str, Any]]:
+    """Turn tuple rows into dicts, looking the column names up once per query."""
+    columns = [c[0] for c in cursor.description]
+    return [dict(zip(columns, row)) for row in (cursor.fetchall() if rows is None else rows)]
+
+
+def _iter_dicts(cursor: sqlite3.Cursor) -> Iterator[Dict[str, Any]]:
+    """Like _dicts(), but fetches FETCH_SIZE rows at a time and yields lazily."""
+    columns = [c[0] for c in cursor.description]
+    while rows := cursor.fetchmany(FETCH_SIZE):
+        for row in rows:
+            yield dict(zip(columns, row))
+
+
 @contextmanager
 def get_db():
-    conn = get_connection()
+    """Borrow a pooled read connection (tuple rows); writes go through _write()."""
+    conn = _acquire_reader()
     try:
         yield conn
         conn.commit()
@@ -28,117 +222,313 @@ def get_db():
         conn.rollback()
         raise
     finally:
-        conn.close()
+        _read_pool.put(conn)
+
+
+SCHEMA_SQL = """
+-- Users table
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER UNIQUE NOT NULL,
+    user_id INTEGER,
+    username TEXT,
+    sphere TEXT DEFAULT 'general',
+    skill TEXT DEFAULT 'feedback',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Conversations table
+CREATE TABLE IF NOT EXISTS conversations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    session_type TEXT NOT NULL,
+    started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    ended_at TIMESTAMP,
+    status TEXT DEFAULT 'active',
+    FOREIGN KEY (chat_id) REFERENCES users(chat_id)
+);
+
+-- Messages table - stores all conversation messages
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    conversation_id INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    message_type TEXT,
+    metadata TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (conversation_id) REFERENCES conversations(id),
+    FOREIGN KEY (chat_id) REFERENCES users(chat_id)
+);
+
+-- User progress table - persists training state
+CREATE TABLE IF NOT EXISTS user_progress (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER UNIQUE NOT NULL,
+    diagnostic_answers TEXT DEFAULT '[]',
+    diagnostic_done INTEGER DEFAULT 0,
+    training_index INTEGER DEFAULT 0,
+    training_case_pending INTEGER DEFAULT 0,
+    skill TEXT DEFAULT 'feedback',
+    skill_chosen INTEGER DEFAULT 0,
+    skill_pending INTEGER DEFAULT 0,
+    sphere TEXT DEFAULT 'general',
+    sphere_chosen INTEGER DEFAULT 0,
+    sphere_pending INTEGER DEFAULT 0,
+    diagnostic_questions TEXT DEFAULT '[]',
+    training_cases TEXT DEFAULT '[]',
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (chat_id) REFERENCES users(chat_id)
+);
+
+-- Skill training sessions table
+CREATE TABLE IF NOT EXISTS skill_sessions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    block_id TEXT NOT NULL,
+    skill_id TEXT NOT NULL,
+    situation TEXT NOT NULL,
+    status TEXT DEFAULT 'pending',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    completed_at TIMESTAMP,
+    FOREIGN KEY (chat_id) REFERENCES users(chat_id)
+);
+
+-- Skill training answers table
+CREATE TABLE IF NOT EXISTS skill_answers (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    user_answer TEXT NOT NULL,
+    ai_feedback TEXT,
+    score INTEGER,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (session_id) REFERENCES skill_sessions(id),
+    FOREIGN KEY (chat_id) REFERENCES users(chat_id)
+);
+
+-- Indexes for faster queries
+-- (chat_id, id) serves both chat filters and newest-first history walks
+DROP INDEX IF EXISTS idx_messages_chat_id;
+CREATE INDEX IF NOT EXISTS idx_messages_chat_id_id ON messages(chat_id, id DESC);
+CREATE INDEX IF NOT EXISTS idx_messages_conversation_id ON messages(conversation_id);
+-- covers the chat filter and the started_at ordering of get_all_conversations
+DROP INDEX IF EXISTS idx_conversations_chat_id;
+CREATE INDEX IF NOT EXISTS idx_conversations_chat_started ON conversations(chat_id, started_at DESC);
+CREATE INDEX IF NOT EXISTS idx_skill_sessions_chat_id ON skill_sessions(chat_id);
+CREATE INDEX IF NOT EXISTS idx_skill_answers_session_id ON skill_answers(session_id);
+"""
+
+
+# Schema v3: indexes shaped like the (chat_id, status) lookups and the score average
+SCHEMA_V3_SQL = """
+CREATE INDEX IF NOT EXISTS idx_conversations_chat_status_started
+    ON conversations(chat_id, status, started_at DESC);
+DROP INDEX IF EXISTS idx_skill_sessions_chat_id;
+CREATE INDEX IF NOT EXISTS idx_skill_sessions_chat_status_created
+    ON skill_sessions(chat_id, status, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_skill_answers_chat_score
+    ON skill_answers(chat_id, score) WHERE score IS NOT NULL;
+ANALYZE;
+"""
+
+
+# Schema v4: move messages into the attached messages database
+SCHEMA_V4_SQL = """
+CREATE TABLE IF NOT EXISTS mdb.messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    conversation_id INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    message_type TEXT,
+    metadata TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+INSERT INTO mdb.messages (id, conversation_id, chat_id, role, content, message_type, metadata, created_at)
+    SELECT id, conversation_id, chat_id, role, content, message_type, metadata, created_at
+    FROM main.messages;
+DROP TABLE main.messages;
+CREATE INDEX IF NOT EXISTS mdb.idx_messages_chat_id_id ON messages(chat_id, id DESC);
+CREATE INDEX IF NOT EXISTS mdb.idx_messages_conversation_id ON messages(conversation_id);
+"""
+
+
+def _progress_flags_migration() -> str:
+    """Schema v2: pack the six boolean user_progress columns into `flags`."""
+    bits = " | ".join(
+        f"((COALESCE({name}, 0) != 0) << {bit})" for bit, name in enumerate(PROGRESS_FLAGS)
+    )
+    script = (
+        "ALTER TABLE user_progress ADD COLUMN flags INTEGER DEFAULT 0;\n"
+        f"UPDATE user_progress SET flags = {bits};\n"
+    )
+    if _HAS_DROP_COLUMN:
+        script += "".join(f"ALTER TABLE user_progress DROP COLUMN {name};\n" for name in PROGRESS_FLAGS)
+    return script
 
 
 def init_db():
-    """Initialize database tables."""
-    with get_db() as conn:
-        cursor = conn.cursor()
-        
-        # Users table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                chat_id INTEGER UNIQUE NOT NULL,
-                user_id INTEGER,
-                username TEXT,
-                sphere TEXT DEFAULT 'general',
-                skill TEXT DEFAULT 'feedback',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # Conversations table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS conversations (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                chat_id INTEGER NOT NULL,
-                session_type TEXT NOT NULL,
-                started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                ended_at TIMESTAMP,
-                status TEXT DEFAULT 'active',
-                FOREIGN KEY (chat_id) REFERENCES users(chat_id)
-            )
-        """)
-        
-        # Messages table - stores all conversation messages
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                conversation_id INTEGER NOT NULL,
-                chat_id INTEGER NOT NULL,
-                role TEXT NOT NULL,
-                content TEXT NOT NULL,
-                message_type TEXT,
-                metadata TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (conversation_id) REFERENCES conversations(id),
-                FOREIGN KEY (chat_id) REFERENCES users(chat_id)
-            )
-        """)
-        
-        # User progress table - persists training state
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS user_progress (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                chat_id INTEGER UNIQUE NOT NULL,
-                diagnostic_answers TEXT DEFAULT '[]',
-                diagnostic_done INTEGER DEFAULT 0,
-                training_index INTEGER DEFAULT 0,
-                training_case_pending INTEGER DEFAULT 0,
-                skill TEXT DEFAULT 'feedback',
-                skill_chosen INTEGER DEFAULT 0,
-                skill_pending INTEGER DEFAULT 0,
-                sphere TEXT DEFAULT 'general',
-                sphere_chosen INTEGER DEFAULT 0,
-                sphere_pending INTEGER DEFAULT 0,
-                diagnostic_questions TEXT DEFAULT '[]',
-                training_cases TEXT DEFAULT '[]',
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (chat_id) REFERENCES users(chat_id)
-            )
-        """)
-        
-        # Skill training sessions table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS skill_sessions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                chat_id INTEGER NOT NULL,
-                block_id TEXT NOT NULL,
-                skill_id TEXT NOT NULL,
-                situation TEXT NOT NULL,
-                status TEXT DEFAULT 'pending',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                completed_at TIMESTAMP,
-                FOREIGN KEY (chat_id) REFERENCES users(chat_id)
-            )
-        """)
-        
-        # Skill training answers table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS skill_answers (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                session_id INTEGER NOT NULL,
-                chat_id INTEGER NOT NULL,
-                user_answer TEXT NOT NULL,
-                ai_feedback TEXT,
-                score INTEGER,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (session_id) REFERENCES skill_sessions(id),
-                FOREIGN KEY (chat_id) REFERENCES users(chat_id)
-            )
-        """)
-        
-        # Create indexes for faster queries
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_chat_id ON messages(chat_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_conversation_id ON messages(conversation_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_conversations_chat_id ON conversations(chat_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_skill_sessions_chat_id ON skill_sessions(chat_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_skill_answers_session_id ON skill_answers(session_id)")
-        
+    """Initialize or migrate database tables; a no-op once the file is at SCHEMA_VERSION."""
+    def work(conn: sqlite3.Connection):
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+        # files created before versioning report 0 but may already have v1 tables
+        steps = []
+        if version < 1:
+            steps.append(SCHEMA_SQL)
+        if version < 2:
+            steps.append(_progress_flags_migration())
+        if version < 3:
+            steps.append(SCHEMA_V3_SQL)
+        if version < 4:
+            steps.append(SCHEMA_V4_SQL)
+        # one script, one transaction, one commit
+        conn.executescript(
+            "BEGIN;\n" + "\n".join(steps) + f"\nPRAGMA user_version = {SCHEMA_VERSION};\nCOMMIT;"
+        )
         logger.info("Database initialized successfully")
+    _write(work, own_transaction=True)
+
+
+# Hot statements are fixed strings so every call hits the connection's
+# prepared-statement cache.
+SQL_GET_USER = "SELECT id, chat_id, user_id, username, sphere, skill FROM users WHERE chat_id = ?"
+# one statement for get-or-create; known ids/usernames are never overwritten with NULL
+SQL_UPSERT_USER = """INSERT INTO users (chat_id, user_id, username) VALUES (?, ?, ?)
+                     ON CONFLICT(chat_id) DO UPDATE SET
+                         user_id = COALESCE(excluded.user_id, users.user_id),
+                         username = COALESCE(excluded.username, users.username)"""
+SQL_UPDATE_USER_SPHERE = "UPDATE users SET sphere = ?, updated_at = CURRENT_TIMESTAMP WHERE chat_id = ?"
+SQL_UPDATE_USER_SKILL = "UPDATE users SET skill = ?, updated_at = CURRENT_TIMESTAMP WHERE chat_id = ?"
+SQL_UPDATE_USER_SPHERE_SKILL = (
+    "UPDATE users SET sphere = ?, skill = ?, updated_at = CURRENT_TIMESTAMP WHERE chat_id = ?"
+)
+SQL_GET_ACTIVE_CONVERSATION = (
+    "SELECT id FROM conversations WHERE chat_id = ? AND status = 'active' ORDER BY started_at DESC LIMIT 1"
+)
+SQL_INSERT_CONVERSATION = "INSERT INTO conversations (chat_id, session_type) VALUES (?, ?)"
+SQL_END_CONVERSATION = (
+    "UPDATE conversations SET ended_at = CURRENT_TIMESTAMP, status = 'completed' WHERE id = ?"
+)
+SQL_INSERT_MESSAGE = """INSERT INTO mdb.messages (conversation_id, chat_id, role, content, message_type, metadata)
+                        VALUES (?, ?, ?, ?, ?, ?)"""
+SQL_GET_PROGRESS = """SELECT chat_id, diagnostic_answers, flags, training_index, skill, sphere,
+                           diagnostic_questions, training_cases
+                    FROM user_progress WHERE chat_id = ?"""
+# newest `limit` rows via the (chat_id, id DESC) index, returned oldest first
+SQL_GET_HISTORY = """SELECT role, content, message_type, metadata, created_at
+                     FROM (SELECT id, role, content, message_type, metadata, created_at
+                           FROM mdb.messages
+                           WHERE chat_id = ?
+                           ORDER BY id DESC
+                           LIMIT ?)
+                     ORDER BY id"""
+SQL_GET_ALL_CONVERSATIONS = """SELECT c.id, c.session_type, c.started_at, c.ended_at, c.status,
+                                      COUNT(m.id) as message_count
+                               FROM conversations c
+                               LEFT JOIN mdb.messages m ON c.id = m.conversation_id
+                               WHERE c.chat_id = ?
+                               GROUP BY c.id
+                               ORDER BY c.started_at DESC"""
+
+# chat_id -> id of its active conversation, plus the reverse map so that
+# end_conversation can drop an entry without scanning; start/end keep both current
+_active_conv_cache: Dict[int, int] = {}
+_active_conv_chats: Dict[int, int] = {}
+_active_conv_lock = threading.Lock()
+
+
+def _cache_active_conversation(chat_id: int, conversation_id: int) -> None:
+    # caller holds _active_conv_lock
+    previous = _active_conv_cache.get(chat_id)
+    if previous is not None:
+        _active_conv_chats.pop(previous, None)
+    _active_conv_cache[chat_id] = conversation_id
+    _active_conv_chats[conversation_id] = chat_id
+
+# chat_id -> (user_id, username) last written by ensure_user; LRU-bounded
+KNOWN_USERS_CACHE_SIZE = 10000
+_known_users: "OrderedDict[int, Tuple[Optional[int], Optional[str]]]" = OrderedDict()
+_known_users_lock = threading.Lock()
+
+_message_buffer: Deque[tuple] = deque()
+_buffer_lock = threading.Lock()
+# one flush at a time, held from taking the buffer until its batch is written,
+# so a reader's flush waits for messages already in flight and a re-queued
+# batch is never overtaken by a later one
+_message_flush_lock = threading.Lock()
+# queued messages that trigger a flush ahead of the app's periodic one
+MESSAGE_FLUSH_HIGH_WATER = 50
+_flush_scheduler: Optional[Callable[[], None]] = None
+_flush_scheduled = False
+
+
+def set_message_flush_scheduler(schedule: Optional[Callable[[], None]]) -> None:
+    """
+    Register how save_message starts an early flush_messages() once the
+    buffer reaches MESSAGE_FLUSH_HIGH_WATER (the app submits it to its db
+    pool). Without a scheduler the flush runs inline.
+    """
+    global _flush_scheduler
+    _flush_scheduler = schedule
+
+
+def flush_messages() -> None:
+    """Write all queued messages in one transaction."""
+    global _flush_scheduled
+    with _message_flush_lock:
+        with _buffer_lock:
+            if not _message_buffer:
+                _flush_scheduled = False
+                return
+            rows = list(_message_buffer)
+            _message_buffer.clear()
+        try:
+            ConversationDB.save_messages_batch(rows)
+        except Exception:
+            # put them back, ahead of anything queued meanwhile, for the next
+            # flush; the next message past the high-water mark schedules a retry
+            with _buffer_lock:
+                _message_buffer.extendleft(reversed(rows))
+                _flush_scheduled = False
+            raise
+    # messages that piled up during the write may already be past the mark
+    with _buffer_lock:
+        again = _flush_scheduler if len(_message_buffer) >= MESSAGE_FLUSH_HIGH_WATER else None
+        _flush_scheduled = again is not None
+    if again is not None:
+        again()
+
+
+def _insert(cursor: sqlite3.Cursor, sql: str, params: tuple) -> int:
+    """Run a single-row INSERT and return the new id."""
+    if not _HAS_RETURNING:
+        cursor.execute(sql, params)
+        return cursor.lastrowid
+    cursor.execute(sql + " RETURNING id", params)
+    # drain the statement so the transaction can commit
+    return cursor.fetchall()[0][0]
+
+
+def _active_or_new_conversation(cursor: sqlite3.Cursor, chat_id: int) -> int:
+    with _active_conv_lock:
+        cached = _active_conv_cache.get(chat_id)
+    if cached is not None:
+        return cached
+    cursor.execute(
+        SQL_GET_ACTIVE_CONVERSATION,
+        (chat_id,)
+    )
+    row = cursor.fetchone()
+    if row:
+        conversation_id = row["id"]
+    else:
+        conversation_id = _insert(cursor, SQL_INSERT_CONVERSATION, (chat_id, "general"))
+    return conversation_id
 
 
 class ConversationDB:
@@ -146,71 +536,86 @@ class ConversationDB:
     
     @staticmethod
     def get_or_create_user(chat_id: int, user_id: int = None, username: str = None) -> Dict[str, Any]:
-        with get_db() as conn:
+        def work(conn: sqlite3.Connection):
             cursor = conn.cursor()
-            cursor.execute("SELECT * FROM users WHERE chat_id = ?", (chat_id,))
-            row = cursor.fetchone()
-            
-            if row:
-                return dict(row)
-            
-            cursor.execute(
-                "INSERT INTO users (chat_id, user_id, username) VALUES (?, ?, ?)",
-                (chat_id, user_id, username)
-            )
-            return {"chat_id": chat_id, "user_id": user_id, "username": username}
+            if _HAS_RETURNING:
+                cursor.execute(
+                    SQL_UPSERT_USER + " RETURNING id, chat_id, user_id, username, sphere, skill",
+                    (chat_id, user_id, username)
+                )
+                return dict(cursor.fetchall()[0])
+            cursor.execute(SQL_UPSERT_USER, (chat_id, user_id, username))
+            cursor.execute(SQL_GET_USER, (chat_id,))
+            return dict(cursor.fetchone())
+        return _write(work)
     
+    @staticmethod
+    def ensure_user(chat_id: int, user_id: int = None, username: str = None) -> None:
+        """
+        Make sure the user row exists and is current, skipping the write when
+        this process already stored the same user.
+        """
+        with _known_users_lock:
+            known = _known_users.get(chat_id)
+            if known is not None:
+                _known_users.move_to_end(chat_id)
+                if (user_id is None or user_id == known[0]) and (username is None or username == known[1]):
+                    return
+        row = ConversationDB.get_or_create_user(chat_id, user_id, username)
+        with _known_users_lock:
+            _known_users[chat_id] = (row["user_id"], row["username"])
+            _known_users.move_to_end(chat_id)
+            while len(_known_users) > KNOWN_USERS_CACHE_SIZE:
+                _known_users.popitem(last=False)
+
     @staticmethod
     def update_user(chat_id: int, sphere: str = None, skill: str = None):
-        with get_db() as conn:
-            cursor = conn.cursor()
-            updates = []
-            params = []
-            
-            if sphere:
-                updates.append("sphere = ?")
-                params.append(sphere)
-            if skill:
-                updates.append("skill = ?")
-                params.append(skill)
-            
-            if updates:
-                updates.append("updated_at = CURRENT_TIMESTAMP")
-                params.append(chat_id)
-                cursor.execute(
-                    f"UPDATE users SET {', '.join(updates)} WHERE chat_id = ?",
-                    params
-                )
+        if sphere and skill:
+            sql, params = SQL_UPDATE_USER_SPHERE_SKILL, (sphere, skill, chat_id)
+        elif sphere:
+            sql, params = SQL_UPDATE_USER_SPHERE, (sphere, chat_id)
+        elif skill:
+            sql, params = SQL_UPDATE_USER_SKILL, (skill, chat_id)
+        else:
+            return
+        def work(conn: sqlite3.Connection):
+            conn.execute(sql, params)
+        _write(work)
     
     @staticmethod
     def start_conversation(chat_id: int, session_type: str = "training") -> int:
-        with get_db() as conn:
+        def work(conn: sqlite3.Connection):
             cursor = conn.cursor()
-            cursor.execute(
-                "INSERT INTO conversations (chat_id, session_type) VALUES (?, ?)",
-                (chat_id, session_type)
-            )
-            return cursor.lastrowid
+            return _insert(cursor, SQL_INSERT_CONVERSATION, (chat_id, session_type))
+        conversation_id = _write(work)
+        with _active_conv_lock:
+            _cache_active_conversation(chat_id, conversation_id)
+        return conversation_id
     
     @staticmethod
     def end_conversation(conversation_id: int):
-        with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "UPDATE conversations SET ended_at = CURRENT_TIMESTAMP, status = 'completed' WHERE id = ?",
-                (conversation_id,)
-            )
+        def work(conn: sqlite3.Connection):
+            conn.execute(SQL_END_CONVERSATION, (conversation_id,))
+        _write(work)
+        with _active_conv_lock:
+            chat_id = _active_conv_chats.pop(conversation_id, None)
+            if chat_id is not None:
+                del _active_conv_cache[chat_id]
     
     @staticmethod
     def get_active_conversation(chat_id: int) -> Optional[int]:
+        with _active_conv_lock:
+            cached = _active_conv_cache.get(chat_id)
+        if cached is not None:
+            return cached
         with get_db() as conn:
             cursor = conn.cursor()
             cursor.execute(
-                "SELECT id FROM conversations WHERE chat_id = ? AND status = 'active' ORDER BY started_at DESC LIMIT 1",
+                SQL_GET_ACTIVE_CONVERSATION,
                 (chat_id,)
             )
             row = cursor.fetchone()
-            return row["id"] if row else None
+            return row[0] if row else None
     
     @staticmethod
     def save_message(
@@ -220,149 +625,315 @@ class ConversationDB:
         message_type: str = None,
         metadata: Dict[str, Any] = None,
         conversation_id: int = None
-    ) -> int:
-        with get_db() as conn:
+    ) -> None:
+        """
+        Queue a message for flush_messages(), which the app runs periodically
+        and before every history read. Past MESSAGE_FLUSH_HIGH_WATER queued
+        messages one early flush is handed to the registered scheduler.
+        """
+        global _flush_scheduled
+        row = (chat_id, role, content, message_type, orjson.dumps(metadata).decode() if metadata else None, conversation_id)
+        with _buffer_lock:
+            _message_buffer.append(row)
+            schedule = _flush_scheduler
+            backlog = len(_message_buffer) >= MESSAGE_FLUSH_HIGH_WATER and not _flush_scheduled
+            if backlog:
+                _flush_scheduled = True
+        if not backlog:
+            return
+        if schedule is None:
+            flush_messages()
+        else:
+            schedule()
+
+    @staticmethod
+    def save_messages_batch(rows: List[tuple]) -> None:
+        """
+        Insert (chat_id, role, content, message_type, metadata_json, conversation_id)
+        rows in one transaction. The active conversation is resolved once per chat.
+        """
+        conversations: Dict[int, int] = {}
+
+        def work(conn: sqlite3.Connection):
             cursor = conn.cursor()
-            
-            # Get or create active conversation
-            if not conversation_id:
-                cursor.execute(
-                    "SELECT id FROM conversations WHERE chat_id = ? AND status = 'active' ORDER BY started_at DESC LIMIT 1",
-                    (chat_id,)
-                )
-                row = cursor.fetchone()
-                if row:
-                    conversation_id = row["id"]
-                else:
-                    cursor.execute(
-                        "INSERT INTO conversations (chat_id, session_type) VALUES (?, ?)",
-                        (chat_id, "general")
-                    )
-                    conversation_id = cursor.lastrowid
-            
-            cursor.execute(
-                """INSERT INTO messages (conversation_id, chat_id, role, content, message_type, metadata)
-                   VALUES (?, ?, ?, ?, ?, ?)""",
-                (conversation_id, chat_id, role, content, message_type, json.dumps(metadata) if metadata else None)
-            )
-            return cursor.lastrowid
+            params = []
+            for chat_id, role, content, message_type, metadata, conversation_id in rows:
+                if not conversation_id:
+                    conversation_id = conversations.get(chat_id)
+                    if conversation_id is None:
+                        conversation_id = _active_or_new_conversation(cursor, chat_id)
+                        conversations[chat_id] = conversation_id
+                params.append((conversation_id, chat_id, role, content, message_type, metadata))
+            cursor.executemany(SQL_INSERT_MESSAGE, params)
+        _write(work)
+        # only after commit, so a rolled-back conversation is never cached
+        with _active_conv_lock:
+            for chat_id, conversation_id in conversations.items():
+                _cache_active_conversation(chat_id, conversation_id)
     
     @staticmethod
-    def get_conversation_history(chat_id: int, limit: int = 50) -> List[Dict[str, Any]]:
+    def iter_conversation_history(chat_id: int, limit: int = 50) -> Iterator[Dict[str, Any]]:
+        """
+        Yield history oldest first. The pooled connection is held until the
+        iterator is exhausted or closed.
+        """
+        flush_messages()
         with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                """SELECT role, content, message_type, metadata, created_at 
-                   FROM messages 
-                   WHERE chat_id = ? 
-                   ORDER BY created_at DESC 
-                   LIMIT ?""",
-                (chat_id, limit)
-            )
-            rows = cursor.fetchall()
-            return [dict(row) for row in reversed(rows)]
+            yield from _iter_dicts(conn.execute(SQL_GET_HISTORY, (chat_id, limit)))
+
+    @staticmethod
+    def get_conversation_history(chat_id: int, limit: int = 50) -> List[Dict[str, Any]]:
+        return list(ConversationDB.iter_conversation_history(chat_id, limit))
     
     @staticmethod
-    def get_all_conversations(chat_id: int) -> List[Dict[str, Any]]:
+    def iter_all_conversations(chat_id: int) -> Iterator[Dict[str, Any]]:
+        flush_messages()
         with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                """SELECT c.id, c.session_type, c.started_at, c.ended_at, c.status,
-                          COUNT(m.id) as message_count
-                   FROM conversations c
-                   LEFT JOIN messages m ON c.id = m.conversation_id
-                   WHERE c.chat_id = ?
-                   GROUP BY c.id
-                   ORDER BY c.started_at DESC""",
-                (chat_id,)
-            )
-            return [dict(row) for row in cursor.fetchall()]
+            yield from _iter_dicts(conn.execute(SQL_GET_ALL_CONVERSATIONS, (chat_id,)))
+
+    @staticmethod
+    def get_all_conversations(chat_id: int) -> List[Dict[str, Any]]:
+        return list(ConversationDB.iter_all_conversations(chat_id))
+
+
+# One statement instead of SELECT + INSERT/UPDATE; chat_id is UNIQUE.
+# List columns hold orjson bytes (older rows are JSON text; both decode).
+SQL_UPSERT_PROGRESS = """
+    INSERT INTO user_progress (
+        chat_id, diagnostic_answers, flags, training_index, skill, sphere,
+        diagnostic_questions, training_cases
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(chat_id) DO UPDATE SET
+        diagnostic_answers = excluded.diagnostic_answers,
+        flags = excluded.flags,
+        training_index = excluded.training_index,
+        skill = excluded.skill,
+        sphere = excluded.sphere,
+        diagnostic_questions = excluded.diagnostic_questions,
+        training_cases = excluded.training_cases,
+        updated_at = CURRENT_TIMESTAMP
+"""
+
+
+# Boolean progress fields, stored as bits of user_progress.flags (bit = index)
+PROGRESS_FLAGS = (
+    "diagnostic_done",
+    "training_case_pending",
+    "skill_chosen",
+    "skill_pending",
+    "sphere_chosen",
+    "sphere_pending",
+)
+
+
+@dataclass(slots=True)
+class Progress:
+    """A user_progress row, decoded."""
+
+    chat_id: int
+    diagnostic_answers: List[str]
+    training_index: int
+    skill: str
+    sphere: str
+    diagnostic_questions: List[Dict[str, Any]]
+    training_cases: List[str]
+    diagnostic_done: bool = False
+    training_case_pending: bool = False
+    skill_chosen: bool = False
+    skill_pending: bool = False
+    sphere_chosen: bool = False
+    sphere_pending: bool = False
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+# Write-behind state: the last saved column values per chat and the columns
+# not yet written (None means the whole row, upserted).
+PROGRESS_COLUMNS = (
+    "diagnostic_answers",
+    "flags",
+    "training_index",
+    "skill",
+    "sphere",
+    "diagnostic_questions",
+    "training_cases",
+)
+# _progress_rows doubles as a read cache (LRU; dirty rows and rows of the
+# flush in flight are never evicted).
+PROGRESS_CACHE_SIZE = 10000
+_progress_rows: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+_progress_dirty: Dict[int, Optional[set]] = {}
+_progress_flushing: set = set()
+_progress_lock = threading.Lock()
+# one flush at a time, so _progress_flushing belongs to a single flush
+_progress_flush_lock = threading.Lock()
+
+
+def _trim_progress_rows() -> None:
+    # caller holds _progress_lock
+    excess = len(_progress_rows) - PROGRESS_CACHE_SIZE
+    if excess <= 0:
+        return
+    # oldest clean rows first; stop as soon as enough are found
+    clean = (c for c in _progress_rows if c not in _progress_dirty and c not in _progress_flushing)
+    for chat_id in list(islice(clean, excess)):
+        del _progress_rows[chat_id]
+
+
+def _mark_dirty(chat_id: int, columns: Optional[set]) -> None:
+    # caller holds _progress_lock
+    if chat_id in _progress_dirty:
+        pending = _progress_dirty[chat_id]
+        if pending is None or columns is None:
+            _progress_dirty[chat_id] = None
+        else:
+            pending |= columns
+    else:
+        _progress_dirty[chat_id] = None if columns is None else set(columns)
+
+
+def flush_progress() -> None:
+    """Write pending progress changes in one transaction, touching only dirty columns."""
+    with _progress_flush_lock:
+        _flush_progress()
+
+
+def _flush_progress() -> None:
+    # caller holds _progress_flush_lock
+    with _progress_lock:
+        if not _progress_dirty:
+            return
+        rows = {chat_id: _progress_rows[chat_id] for chat_id in _progress_dirty}
+        dirty = dict(_progress_dirty)
+        _progress_dirty.clear()
+        _progress_flushing.update(dirty)
+    try:
+        upserts = []
+        updates: Dict[Tuple[str, ...], list] = {}
+        for chat_id, columns in dirty.items():
+            row = rows[chat_id]
+            if columns is None:
+                upserts.append((chat_id, *(row[c] for c in PROGRESS_COLUMNS)))
+                continue
+            names = tuple(c for c in PROGRESS_COLUMNS if c in columns)
+            updates.setdefault(names, []).append((*(row[c] for c in names), chat_id))
+
+        def work(conn: sqlite3.Connection):
+            if upserts:
+                conn.executemany(SQL_UPSERT_PROGRESS, upserts)
+            # one statement per distinct set of dirty columns
+            for names, params in updates.items():
+                assignments = ", ".join(f"{c} = ?" for c in names)
+                conn.executemany(
+                    f"UPDATE user_progress SET {assignments}, updated_at = CURRENT_TIMESTAMP WHERE chat_id = ?",
+                    params
+                )
+        _write(work)
+    except Exception:
+        # keep the changes for the next flush
+        with _progress_lock:
+            for chat_id, columns in dirty.items():
+                _mark_dirty(chat_id, columns)
+        raise
+    finally:
+        with _progress_lock:
+            _progress_flushing.clear()
+            _trim_progress_rows()
 
 
 class ProgressDB:
     """Database operations for user progress (persistent state)."""
     
     @staticmethod
-    def get_progress(chat_id: int) -> Optional[Dict[str, Any]]:
-        with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM user_progress WHERE chat_id = ?", (chat_id,))
-            row = cursor.fetchone()
-            if row:
-                data = dict(row)
-                data["diagnostic_answers"] = json.loads(data["diagnostic_answers"] or "[]")
-                data["diagnostic_questions"] = json.loads(data["diagnostic_questions"] or "[]")
-                data["training_cases"] = json.loads(data["training_cases"] or "[]")
-                return data
-            return None
+    def get_progress(chat_id: int) -> Optional[Progress]:
+        """Decode progress from the row cache, reading the database on a miss."""
+        with _progress_lock:
+            cached = _progress_rows.get(chat_id)
+            if cached is not None:
+                _progress_rows.move_to_end(chat_id)
+        if cached is None:
+            with get_db() as conn:
+                row = conn.execute(SQL_GET_PROGRESS, (chat_id,)).fetchone()
+            if row is None:
+                return None
+            # row[1:] follows PROGRESS_COLUMNS, as selected by SQL_GET_PROGRESS
+            with _progress_lock:
+                cached = _progress_rows.setdefault(chat_id, dict(zip(PROGRESS_COLUMNS, row[1:])))
+                _trim_progress_rows()
+        flags = cached["flags"] or 0  # bit order as in PROGRESS_FLAGS
+        return Progress(
+            chat_id=chat_id,
+            diagnostic_answers=orjson.loads(cached["diagnostic_answers"] or b"[]"),
+            training_index=cached["training_index"],
+            skill=cached["skill"],
+            sphere=cached["sphere"],
+            diagnostic_questions=orjson.loads(cached["diagnostic_questions"] or b"[]"),
+            training_cases=orjson.loads(cached["training_cases"] or b"[]"),
+            diagnostic_done=bool(flags & 1),
+            training_case_pending=bool(flags & 2),
+            skill_chosen=bool(flags & 4),
+            skill_pending=bool(flags & 8),
+            sphere_chosen=bool(flags & 16),
+            sphere_pending=bool(flags & 32),
+        )
     
     @staticmethod
     def save_progress(chat_id: int, progress: Dict[str, Any]):
-        with get_db() as conn:
-            cursor = conn.cursor()
-            
-            # Check if exists
-            cursor.execute("SELECT id FROM user_progress WHERE chat_id = ?", (chat_id,))
-            exists = cursor.fetchone()
-            
-            diagnostic_answers = json.dumps(progress.get("diagnostic_answers", []))
-            diagnostic_questions = json.dumps(progress.get("diagnostic_questions", []))
-            training_cases = json.dumps(progress.get("training_cases", []))
-            
-            if exists:
-                cursor.execute("""
-                    UPDATE user_progress SET
-                        diagnostic_answers = ?,
-                        diagnostic_done = ?,
-                        training_index = ?,
-                        training_case_pending = ?,
-                        skill = ?,
-                        skill_chosen = ?,
-                        skill_pending = ?,
-                        sphere = ?,
-                        sphere_chosen = ?,
-                        sphere_pending = ?,
-                        diagnostic_questions = ?,
-                        training_cases = ?,
-                        updated_at = CURRENT_TIMESTAMP
-                    WHERE chat_id = ?
-                """, (
-                    diagnostic_answers,
-                    int(progress.get("diagnostic_done", False)),
-                    progress.get("training_index", 0),
-                    int(progress.get("training_case_pending", False)),
-                    progress.get("skill", "feedback"),
-                    int(progress.get("skill_chosen", False)),
-                    int(progress.get("skill_pending", False)),
-                    progress.get("sphere", "general"),
-                    int(progress.get("sphere_chosen", False)),
-                    int(progress.get("sphere_pending", False)),
-                    diagnostic_questions,
-                    training_cases,
-                    chat_id
-                ))
+        """
+        Record progress; only columns that changed since the last save are
+        marked dirty and written by the next flush_progress().
+        """
+        flags = 0
+        for bit, name in enumerate(PROGRESS_FLAGS):
+            if progress.get(name):
+                flags |= 1 << bit
+        row = {
+            "diagnostic_answers": orjson.dumps(progress.get("diagnostic_answers", [])),
+            "flags": flags,
+            "training_index": progress.get("training_index", 0),
+            "skill": progress.get("skill", "feedback"),
+            "sphere": progress.get("sphere", "general"),
+            "diagnostic_questions": orjson.dumps(progress.get("diagnostic_questions", [])),
+            "training_cases": orjson.dumps(progress.get("training_cases", [])),
+        }
+        with _progress_lock:
+            previous = _progress_rows.get(chat_id)
+            _progress_rows[chat_id] = row
+            _progress_rows.move_to_end(chat_id)
+            if previous is None:
+                _mark_dirty(chat_id, None)
             else:
-                cursor.execute("""
-                    INSERT INTO user_progress (
-                        chat_id, diagnostic_answers, diagnostic_done, training_index,
-                        training_case_pending, skill, skill_chosen, skill_pending,
-                        sphere, sphere_chosen, sphere_pending, diagnostic_questions, training_cases
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    chat_id,
-                    diagnostic_answers,
-                    int(progress.get("diagnostic_done", False)),
-                    progress.get("training_index", 0),
-                    int(progress.get("training_case_pending", False)),
-                    progress.get("skill", "feedback"),
-                    int(progress.get("skill_chosen", False)),
-                    int(progress.get("skill_pending", False)),
-                    progress.get("sphere", "general"),
-                    int(progress.get("sphere_chosen", False)),
-                    int(progress.get("sphere_pending", False)),
-                    diagnostic_questions,
-                    training_cases
-                ))
+                changed = {column for column, value in row.items() if previous.get(column) != value}
+                if changed:
+                    _mark_dirty(chat_id, changed)
+            _trim_progress_rows()
+
+
+SESSION_COLUMNS = "id, chat_id, block_id, skill_id, situation, status, created_at, completed_at"
+ANSWER_COLUMNS = "id, session_id, chat_id, user_answer, ai_feedback, score, created_at"
+SQL_INSERT_SESSION = """INSERT INTO skill_sessions (chat_id, block_id, skill_id, situation, status)
+                        VALUES (?, ?, ?, ?, 'pending')"""
+SQL_GET_SESSION = f"SELECT {SESSION_COLUMNS} FROM skill_sessions WHERE id = ?"
+SQL_GET_PENDING_SESSION = (
+    f"SELECT {SESSION_COLUMNS} FROM skill_sessions"
+    " WHERE chat_id = ? AND status = 'pending' ORDER BY created_at DESC LIMIT 1"
+)
+SQL_GET_SESSION_ANSWERS = f"SELECT {ANSWER_COLUMNS} FROM skill_answers WHERE session_id = ? ORDER BY created_at"
+# totals and the average score in one pass; by-block counts share the snapshot
+SQL_GET_SKILL_TOTALS = """SELECT COUNT(*) AS total,
+                                 COALESCE(SUM(status = 'completed'), 0) AS completed,
+                                 (SELECT AVG(score) FROM skill_answers
+                                  WHERE chat_id = ? AND score IS NOT NULL) AS avg_score
+                          FROM skill_sessions WHERE chat_id = ?"""
+SQL_GET_SKILL_BY_BLOCK = """SELECT block_id, COUNT(*) as count, 
+                            SUM(CASE WHEN status = 'completed' THEN 1 ELSE 0 END) as completed
+                            FROM skill_sessions WHERE chat_id = ? GROUP BY block_id"""
+SQL_INSERT_ANSWER = """INSERT INTO skill_answers (session_id, chat_id, user_answer, ai_feedback, score)
+                       VALUES (?, ?, ?, ?, ?)"""
+SQL_COMPLETE_SESSION = (
+    "UPDATE skill_sessions SET status = 'completed', completed_at = CURRENT_TIMESTAMP WHERE id = ?"
+)
 
 
 class SkillTrainingDB:
@@ -371,64 +942,65 @@ class SkillTrainingDB:
     @staticmethod
     def create_session(chat_id: int, block_id: str, skill_id: str, situation: str) -> int:
         """Create a new skill training session."""
-        with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                """INSERT INTO skill_sessions (chat_id, block_id, skill_id, situation, status)
-                   VALUES (?, ?, ?, ?, 'pending')""",
-                (chat_id, block_id, skill_id, situation)
-            )
-            return cursor.lastrowid
+        def work(conn: sqlite3.Connection):
+            return _insert(conn.cursor(), SQL_INSERT_SESSION, (chat_id, block_id, skill_id, situation))
+        return _write(work)
     
     @staticmethod
     def get_session(session_id: int) -> Optional[Dict[str, Any]]:
         """Get a skill training session by ID."""
         with get_db() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT * FROM skill_sessions WHERE id = ?", (session_id,))
+            cursor.execute(SQL_GET_SESSION, (session_id,))
             row = cursor.fetchone()
-            return dict(row) if row else None
+            return _dicts(cursor, [row])[0] if row else None
     
     @staticmethod
     def get_pending_session(chat_id: int) -> Optional[Dict[str, Any]]:
         """Get the current pending session for a user."""
         with get_db() as conn:
             cursor = conn.cursor()
-            cursor.execute(
-                "SELECT * FROM skill_sessions WHERE chat_id = ? AND status = 'pending' ORDER BY created_at DESC LIMIT 1",
-                (chat_id,)
-            )
+            cursor.execute(SQL_GET_PENDING_SESSION, (chat_id,))
             row = cursor.fetchone()
-            return dict(row) if row else None
+            return _dicts(cursor, [row])[0] if row else None
     
     @staticmethod
     def save_answer(session_id: int, chat_id: int, user_answer: str, ai_feedback: str = None, score: int = None) -> int:
         """Save user's answer to a skill training session."""
-        with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                """INSERT INTO skill_answers (session_id, chat_id, user_answer, ai_feedback, score)
-                   VALUES (?, ?, ?, ?, ?)""",
-                (session_id, chat_id, user_answer, ai_feedback, score)
+        def work(conn: sqlite3.Connection):
+            return _insert(
+                conn.cursor(), SQL_INSERT_ANSWER, (session_id, chat_id, user_answer, ai_feedback, score)
             )
-            return cursor.lastrowid
+        return _write(work)
     
     @staticmethod
     def complete_session(session_id: int):
         """Mark a session as completed."""
-        with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "UPDATE skill_sessions SET status = 'completed', completed_at = CURRENT_TIMESTAMP WHERE id = ?",
-                (session_id,)
+        def work(conn: sqlite3.Connection):
+            conn.execute(SQL_COMPLETE_SESSION, (session_id,))
+        _write(work)
+
+    @staticmethod
+    def submit_answer(
+        session_id: int, chat_id: int, user_answer: str, ai_feedback: str = None, score: int = None
+    ) -> int:
+        """Save the answer and complete its session in one transaction."""
+        def work(conn: sqlite3.Connection):
+            answer_id = _insert(
+                conn.cursor(), SQL_INSERT_ANSWER, (session_id, chat_id, user_answer, ai_feedback, score)
             )
+            conn.execute(SQL_COMPLETE_SESSION, (session_id,))
+            return answer_id
+        return _write(work)
     
     @staticmethod
-    def get_user_sessions(chat_id: int, block_id: str = None, skill_id: str = None) -> List[Dict[str, Any]]:
-        """Get all sessions for a user, optionally filtered by block/skill."""
+    def iter_user_sessions(
+        chat_id: int, block_id: str = None, skill_id: str = None, limit: int = None
+    ) -> Iterator[Dict[str, Any]]:
+        """Yield sessions for a user (newest first), optionally filtered by block/skill."""
         with get_db() as conn:
             cursor = conn.cursor()
-            query = "SELECT * FROM skill_sessions WHERE chat_id = ?"
+            query = f"SELECT {SESSION_COLUMNS} FROM skill_sessions WHERE chat_id = ?"
             params = [chat_id]
             
             if block_id:
@@ -439,55 +1011,42 @@ class SkillTrainingDB:
                 params.append(skill_id)
             
             query += " ORDER BY created_at DESC"
+            if limit:
+                query += " LIMIT ?"
+                params.append(limit)
             cursor.execute(query, params)
-            return [dict(row) for row in cursor.fetchall()]
+            yield from _iter_dicts(cursor)
+
+    @staticmethod
+    def get_user_sessions(
+        chat_id: int, block_id: str = None, skill_id: str = None, limit: int = None
+    ) -> List[Dict[str, Any]]:
+        """Get sessions for a user (newest first), optionally filtered by block/skill."""
+        return list(SkillTrainingDB.iter_user_sessions(chat_id, block_id, skill_id, limit))
     
     @staticmethod
     def get_session_answers(session_id: int) -> List[Dict[str, Any]]:
         """Get all answers for a session."""
         with get_db() as conn:
             cursor = conn.cursor()
-            cursor.execute(
-                "SELECT * FROM skill_answers WHERE session_id = ? ORDER BY created_at",
-                (session_id,)
-            )
-            return [dict(row) for row in cursor.fetchall()]
+            cursor.execute(SQL_GET_SESSION_ANSWERS, (session_id,))
+            return _dicts(cursor)
     
     @staticmethod
     def get_user_progress(chat_id: int) -> Dict[str, Any]:
         """Get user's overall progress across all skills."""
         with get_db() as conn:
             cursor = conn.cursor()
+            # one read transaction, so totals and by_block see the same snapshot
+            conn.execute("BEGIN")
             
-            # Total sessions
-            cursor.execute(
-                "SELECT COUNT(*) as total FROM skill_sessions WHERE chat_id = ?",
-                (chat_id,)
-            )
-            total = cursor.fetchone()["total"]
-            
-            # Completed sessions
-            cursor.execute(
-                "SELECT COUNT(*) as completed FROM skill_sessions WHERE chat_id = ? AND status = 'completed'",
-                (chat_id,)
-            )
-            completed = cursor.fetchone()["completed"]
+            # Total, completed and average score
+            cursor.execute(SQL_GET_SKILL_TOTALS, (chat_id, chat_id))
+            total, completed, avg_score = cursor.fetchone()
             
             # Sessions by block
-            cursor.execute(
-                """SELECT block_id, COUNT(*) as count, 
-                   SUM(CASE WHEN status = 'completed' THEN 1 ELSE 0 END) as completed
-                   FROM skill_sessions WHERE chat_id = ? GROUP BY block_id""",
-                (chat_id,)
-            )
-            by_block = [dict(row) for row in cursor.fetchall()]
-            
-            # Average score
-            cursor.execute(
-                "SELECT AVG(score) as avg_score FROM skill_answers WHERE chat_id = ? AND score IS NOT NULL",
-                (chat_id,)
-            )
-            avg_score = cursor.fetchone()["avg_score"]
+            cursor.execute(SQL_GET_SKILL_BY_BLOCK, (chat_id,))
+            by_block = _dicts(cursor)
             
             return {
                 "total_sessions": total,
@@ -496,6 +1055,3 @@ class SkillTrainingDB:
                 "average_score": round(avg_score, 2) if avg_score else None
             }
 
-
-# Initialize database on module import
-init_db()
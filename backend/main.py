@@ -1,20 +1,29 @@
 from __future__ import annotations
 
 import asyncio
+import hashlib
 import logging
+import random
 import sys
 import uuid
 import json
-from typing import Any, Dict, List, Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import lru_cache, partial
+from itertools import islice
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
 
 import httpx
+import orjson
 from fastapi import Depends, FastAPI, HTTPException, Request
-from fastapi.responses import JSONResponse, PlainTextResponse
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
 from pydantic import BaseModel, Field
 
 from ai import evaluate_answer, interpret_diagnostic
-from ai_client import AIClient
-from config import Settings
+from ai_client import AIClient, make_ai_http_client
+from config import Settings, get_settings
+from resilience import CircuitBreaker, call_with_retries
 from data import (
     DIAGNOSTIC_QUESTIONS,
     TRAINING_CASES_FEEDBACK,
@@ -22,8 +31,15 @@ from data import (
     SPHERES,
     get_case,
 )
-from state import StateStore
-from database import ConversationDB, SkillTrainingDB, init_db
+from state import StateStore, UserProgress
+from database import (
+    ConversationDB,
+    SkillTrainingDB,
+    flush_messages,
+    flush_progress,
+    init_db,
+    set_message_flush_scheduler,
+)
 from skills_data import SKILL_BLOCKS, get_all_blocks, get_block, get_skill, get_all_skills_flat
 
 
@@ -32,11 +48,76 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Training Bot Backend")
+# orjson for every JSON body; handlers return ORJSONResponse directly, which
+# also skips FastAPI's jsonable_encoder pass over plain dict returns
+app = FastAPI(title="Training Bot Backend", default_response_class=ORJSONResponse)
 state_store = StateStore()
-http_client = httpx.AsyncClient(timeout=15)
-ingest_counter = 0
+# frontend push client; created on startup and closed on shutdown
+http_client: Optional[httpx.AsyncClient] = None
+push_breaker = CircuitBreaker("frontend.push", reset_timeout=60.0)
+# at most one pending reminder per chat; also keeps the tasks referenced
+reminder_tasks: Dict[int, asyncio.Task] = {}
+PUSH_MAX_ATTEMPTS = 3
+ai_http_client = make_ai_http_client()
+INGEST_REQUESTS = Counter("ingest_requests", "Ingest events processed", labelnames=("type",))
+INGEST_LATENCY = Histogram(
+    "ingest_latency_seconds",
+    "Time spent handling /ingest",
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5),
+)
+# label values are client-supplied, so anything unknown is folded into "other"
+INGEST_EVENT_TYPES = frozenset(("action", "callback", "text"))
+# built once on startup and handed to endpoints through get_ai_client
 ai_client: Optional[AIClient] = None
+ai_warmup_task: Optional[asyncio.Task] = None
+db_flush_task: Optional[asyncio.Task] = None
+DB_FLUSH_INTERVAL_SECONDS = 0.5
+# blocking SQLite calls run here so the event loop keeps serving other chats;
+# created on startup, sized like the database read pool
+db_pool: Optional[ThreadPoolExecutor] = None
+DB_POOL_WORKERS = 4
+
+T = TypeVar("T")
+
+
+async def run_db(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking database call on the db pool."""
+    return await asyncio.get_running_loop().run_in_executor(db_pool, partial(fn, *args, **kwargs))
+
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+NDJSON_CHUNK_ROWS = 256
+
+
+def _ndjson_chunk(rows: Iterator[Dict[str, Any]]) -> bytes:
+    lines = [orjson.dumps(row) for row in islice(rows, NDJSON_CHUNK_ROWS)]
+    if len(lines) < NDJSON_CHUNK_ROWS:
+        # last chunk: release the pooled connection before the send
+        rows.close()
+    return b"".join(line + b"\n" for line in lines)
+
+
+async def stream_ndjson(rows: Iterator[Dict[str, Any]]) -> AsyncIterator[bytes]:
+    """Read and encode rows as JSON lines on the db pool, one chunk at a time."""
+    pending: Optional[Future] = None
+    try:
+        while True:
+            pending = db_pool.submit(_ndjson_chunk, rows)
+            chunk = await asyncio.wrap_future(pending)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        if pending is not None and not pending.done():
+            # cancelled (client gone) while a chunk is still being read on the
+            # pool: the generator can only be closed once that read returns
+            pending.add_done_callback(lambda _: rows.close())
+        else:
+            rows.close()
+
+
+def get_ai_client() -> Optional[AIClient]:
+    return ai_client
 
 
 class UserModel(BaseModel):
@@ -70,10 +151,6 @@ class IngestPayload(BaseModel):
     meta: Optional[MetaModel] = None
 
 
-def get_settings() -> Settings:
-    return Settings()
-
-
 def inline_keyboard(options: List[List[Dict[str, str]]]) -> Dict[str, Any]:
     return {"inline": options}
 
@@ -88,18 +165,129 @@ def send_message_action(chat_id: int, text: str, keyboard: Any | None = None) ->
     }
 
 
-def diagnostic_question_payload(idx: int, total: int, chat_id: int, question: Dict[str, Any]) -> Dict[str, Any]:
-    options_raw = question.get("options") or []
+# Static keyboards are built once and shared by every reply that uses them;
+# treat them as read-only.
+MAIN_MENU_KB = inline_keyboard(
+    [
+        [{"text": "Начать диагностику", "data": "action:diagnostic:start"}],
+        [{"text": "Перейти к тренажеру", "data": "action:training:start"}],
+        [{"text": "Напоминания", "data": "action:menu:reminders"}],
+        [{"text": "Сфера деятельности", "data": "action:sphere:menu"}],
+    ]
+)
+CANCEL_ONLY_KB = inline_keyboard(
+    [
+        [{"text": "Отмена", "data": "action:start"}],
+    ]
+)
+MENU_ONLY_KB = inline_keyboard(
+    [
+        [{"text": "В меню", "data": "action:start"}],
+    ]
+)
+AFTER_SPHERE_KB = inline_keyboard(
+    [
+        [{"text": "Начать диагностику", "data": "action:diagnostic:start"}],
+        [{"text": "Перейти к тренажёру", "data": "action:training:start"}],
+        [{"text": "В меню", "data": "action:start"}],
+    ]
+)
+DIAG_DONE_KB = inline_keyboard(
+    [
+        [{"text": "Перейти к тренажёру", "data": "action:training:start"}],
+        [{"text": "Ещё раз диагностику", "data": "action:diagnostic:start"}],
+        [{"text": "В меню", "data": "action:start"}],
+    ]
+)
+REMINDERS_KB = inline_keyboard(
+    [
+        [{"text": "Да, напомни", "data": "remind:later"}],
+        [{"text": "Нет, продолжим", "data": "resume:yes"}],
+    ]
+)
+IDLE_TEXT_KB = inline_keyboard(
+    [
+        [{"text": "Перейти к тренажёру", "data": "action:training:start"}],
+        [{"text": "Прогресс", "data": "action:menu:progress"}],
+        [{"text": "В меню", "data": "action:start"}],
+    ]
+)
+CASE_KB = inline_keyboard(
+    [
+        [{"text": "Напомнить позже", "data": "remind:later"}],
+        [{"text": "В меню", "data": "action:start"}],
+        [{"text": "Выбрать навык", "data": "action:skill:feedback"}],
+    ]
+)
+CASES_OVER_KB = inline_keyboard(
+    [
+        [{"text": "С начала", "data": "training:restart"}],
+        [{"text": "Выбрать навык", "data": "action:skill:feedback"}],
+        [{"text": "Назад в меню", "data": "action:start"}],
+    ]
+)
+REMINDER_PUSH_KB = inline_keyboard(
+    [
+        [{"text": "Продолжить", "data": "resume:yes"}],
+        [{"text": "Напомнить позже", "data": "remind:later"}],
+    ]
+)
+NEXT_CASE_KB = inline_keyboard(
+    [
+        [{"text": "Дальше", "data": "case:next"}],
+    ]
+)
+RETRY_KB = inline_keyboard(
+    [
+        [{"text": "Попробовать снова", "data": "case:retry"}],
+    ]
+)
+RETRY_OR_MENU_KB = inline_keyboard(
+    [
+        [{"text": "Попробовать снова", "data": "case:retry"}],
+        [{"text": "В меню", "data": "action:start"}],
+    ]
+)
+# navigation rows appended to every AI reply
+AI_NAV_ROWS: List[List[Dict[str, str]]] = [
+    [{"text": "В меню", "data": "action:start"}],
+    [{"text": "Выбрать навык", "data": "action:skill:feedback"}],
+]
+SPHERE_LABELS: Dict[str, str] = dict(SPHERES)
+SPHERE_CHOICE_KB = inline_keyboard([[{"text": label, "data": f"action:sphere:{code}"}] for code, label in SPHERES])
+SECTION_UNAVAILABLE_TEXT = "Этот раздел временно недоступен."
+FALLBACK_SITUATION_TEXT = "Опишите ситуацию, в которой вам нужно применить навык '{name}'. Как бы вы действовали?"
+
+
+def diagnostic_keyboard(idx: int, options_raw: List[Any]) -> Dict[str, Any]:
     options = []
     for opt_idx, opt in enumerate(options_raw):
         text = str(opt).strip()
         if not text:
             continue
         options.append([{"text": text, "data": f"diag:{idx}:{opt_idx}"}])
+    return inline_keyboard(options)
+
+
+# static fallback in the same shape the model returns; read-only, shared by all chats
+_STATIC_DIAG_QUESTIONS: Tuple[Dict[str, Any], ...] = tuple(
+    {"text": q["text"], "options": [opt[0] for opt in q["options"]]}
+    for q in DIAGNOSTIC_QUESTIONS
+)
+_STATIC_DIAG_KEYBOARDS: Tuple[Dict[str, Any], ...] = tuple(
+    diagnostic_keyboard(idx, q["options"]) for idx, q in enumerate(_STATIC_DIAG_QUESTIONS)
+)
+
+
+def diagnostic_question_payload(idx: int, total: int, chat_id: int, question: Dict[str, Any]) -> Dict[str, Any]:
+    if idx < len(_STATIC_DIAG_QUESTIONS) and question is _STATIC_DIAG_QUESTIONS[idx]:
+        keyboard = _STATIC_DIAG_KEYBOARDS[idx]
+    else:
+        keyboard = diagnostic_keyboard(idx, question.get("options") or [])
     return send_message_action(
         chat_id=chat_id,
         text=f"Диагностика, вопрос {idx + 1}/{total}:\n\n{question.get('text')}",
-        keyboard=inline_keyboard(options),
+        keyboard=keyboard,
     )
 
 
@@ -108,25 +296,22 @@ def training_case_payload(skill: str, idx: int, chat_id: int, cases: List[str])
         return send_message_action(
             chat_id=chat_id,
             text="Кейсы закончились. Можем пройти заново или выбрать другой навык.",
-            keyboard=inline_keyboard(
-                [
-                    [{"text": "С начала", "data": "training:restart"}],
-                    [{"text": "Выбрать навык", "data": "action:skill:feedback"}],
-                    [{"text": "Назад в меню", "data": "action:start"}],
-                ]
-            ),
+            keyboard=CASES_OVER_KB,
         )
     return send_message_action(
         chat_id=chat_id,
         text=f"Кейс {idx + 1}:\n\n{cases[idx]}",
-        keyboard=inline_keyboard(
-            [
-                [{"text": "Напомнить позже", "data": "remind:later"}],
-                [{"text": "В меню", "data": "action:start"}],
-                [{"text": "Выбрать навык", "data": "action:skill:feedback"}],
-            ]
-        ),
+        keyboard=CASE_KB,
+    )
+
+
+def make_push_http_client() -> httpx.AsyncClient:
+    """Keep-alive pool for frontend pushes; HTTP/2 is used when the push URL is https."""
+    transport = httpx.AsyncHTTPTransport(
+        http2=True,
+        limits=httpx.Limits(max_connections=200, max_keepalive_connections=100),
     )
+    return httpx.AsyncClient(timeout=httpx.Timeout(15.0, connect=3.0), transport=transport)
 
 
 async def schedule_reminder(settings: Settings, chat_id: int, token: Optional[str]) -> None:
@@ -140,27 +325,49 @@ async def schedule_reminder(settings: Settings, chat_id: int, token: Optional[st
             send_message_action(
                 chat_id=chat_id,
                 text="Напоминаю: у тебя незавершённый кейс. Продолжаем?",
-                keyboard=inline_keyboard(
-                    [
-                        [{"text": "Продолжить", "data": "resume:yes"}],
-                        [{"text": "Напомнить позже", "data": "remind:later"}],
-                    ]
-                ),
+                keyboard=REMINDER_PUSH_KB,
             )
         ]
     }
-    headers = {}
+    headers = {"Content-Type": "application/json"}
     if token:
         headers["Authorization"] = f"Bearer {token}"
 
     try:
-        resp = await http_client.post(settings.frontend_push_url, json=payload, headers=headers)
-        resp.raise_for_status()
+        await push_to_frontend(settings.frontend_push_url, orjson.dumps(payload), headers)
         logger.info("Reminder push sent to frontend for chat %s", chat_id)
     except Exception as exc:  # noqa: BLE001
         logger.warning("Failed to push reminder: %s", exc)
 
 
+def start_reminder(settings: Settings, chat_id: int) -> None:
+    """Schedule a reminder push for the chat, replacing any pending one."""
+    previous = reminder_tasks.get(chat_id)
+    if previous is not None:
+        previous.cancel()
+    task = asyncio.create_task(
+        schedule_reminder(settings, chat_id, settings.frontend_push_token), name=f"reminder:{chat_id}"
+    )
+    reminder_tasks[chat_id] = task
+
+    def forget(done: asyncio.Task) -> None:
+        # a cancelled predecessor finishes after its replacement is registered
+        if reminder_tasks.get(chat_id) is done:
+            del reminder_tasks[chat_id]
+
+    task.add_done_callback(forget)
+
+
+async def push_to_frontend(url: str, content: bytes, headers: Dict[str, str]) -> None:
+    """POST to the frontend with retries, behind its own breaker."""
+
+    async def send() -> None:
+        resp = await http_client.post(url, content=content, headers=headers)
+        resp.raise_for_status()
+
+    await call_with_retries(push_breaker, PUSH_MAX_ATTEMPTS, send, "Frontend push")
+
+
 def progress_summary(state) -> str:
     diag = "пройдено" if state.diagnostic_done else "не завершена"
     return (
@@ -170,33 +377,31 @@ def progress_summary(state) -> str:
     )
 
 
+# ensure_* take the request's AI client, or None when AI is not configured
 async def ensure_diagnostic_questions(
     state, settings: Settings, ai: Optional[AIClient]
 ) -> List[Dict[str, Any]]:
-    if ai and ai.enabled() and not state.diagnostic_questions:
+    if ai is not None and not state.diagnostic_questions:
         try:
-            state.diagnostic_questions = await ai.generate_diagnostic(
+            state.diagnostic_questions = await ai.cached_diagnostic(
                 sphere=state.sphere,
                 skill=state.skill,
             )
         except Exception as exc:  # noqa: BLE001
             logger.warning("AI diagnostic generation failed: %s", exc)
             state.diagnostic_questions = []
-    if not state.diagnostic_questions and not (ai and ai.enabled()):
+    if not state.diagnostic_questions and ai is None:
         # Only fallback to static when AI недоступен
-        state.diagnostic_questions = [
-            {"text": q["text"], "options": [opt[0] for opt in q["options"]]}
-            for q in DIAGNOSTIC_QUESTIONS
-        ]
+        state.diagnostic_questions = list(_STATIC_DIAG_QUESTIONS)
     return state.diagnostic_questions
 
 
 async def ensure_training_cases(
     state, skill: str, settings: Settings, ai: Optional[AIClient]
 ) -> List[str]:
-    if ai and ai.enabled() and not state.training_cases:
+    if ai is not None and not state.training_cases:
         try:
-            state.training_cases = await ai.generate_cases(skill=skill, sphere=state.sphere)
+            state.training_cases = await ai.cached_cases(skill=skill, sphere=state.sphere)
         except Exception as exc:  # noqa: BLE001
             logger.warning("AI cases generation failed, fallback to defaults: %s", exc)
             state.training_cases = []
@@ -207,55 +412,104 @@ async def ensure_training_cases(
     return state.training_cases
 
 
+# probes hit this constantly, so the response is built once and shared; the
+# header middleware only ever re-sets the same X-Backend value on it
+HEALTH_RESPONSE = Response(b'{"ok":true}', media_type="application/json")
+
+
 @app.get("/health")
-async def health() -> Dict[str, Any]:
-    return {"ok": True}
+async def health() -> Response:
+    return HEALTH_RESPONSE
 
 
 @app.get("/conversations/{chat_id}")
-async def get_conversations(chat_id: int) -> JSONResponse:
+async def get_conversations(chat_id: int) -> ORJSONResponse:
     """Get all conversations for a user."""
-    conversations = ConversationDB.get_all_conversations(chat_id)
-    return JSONResponse({"conversations": conversations})
+    conversations = await run_db(ConversationDB.get_all_conversations, chat_id)
+    return ORJSONResponse({"conversations": conversations})
 
 
 @app.get("/conversations/{chat_id}/history")
-async def get_conversation_history(chat_id: int, limit: int = 50) -> JSONResponse:
-    """Get conversation history (messages) for a user."""
-    messages = ConversationDB.get_conversation_history(chat_id, limit)
-    return JSONResponse({"messages": messages})
+async def get_conversation_history(request: Request, chat_id: int, limit: int = 50) -> Response:
+    """
+    Get conversation history (messages) for a user. Clients that accept
+    application/x-ndjson get one message per line, streamed as it is read.
+    """
+    if NDJSON_MEDIA_TYPE in request.headers.get("accept", ""):
+        rows = ConversationDB.iter_conversation_history(chat_id, limit)
+        return StreamingResponse(stream_ndjson(rows), media_type=NDJSON_MEDIA_TYPE)
+    messages = await run_db(ConversationDB.get_conversation_history, chat_id, limit)
+    return ORJSONResponse({"messages": messages})
 
 
 @app.get("/metrics")
-async def metrics() -> PlainTextResponse:
-    return PlainTextResponse(f"ingest_requests {ingest_counter}")
+async def metrics() -> Response:
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
 
 # ==================== SKILL TRAINING ENDPOINTS ====================
 
+# The skill catalog is static, so its responses are encoded once and served
+# with an ETag. Lookups are validated before hitting the caches, which
+# therefore only ever hold real catalog entries.
+
+
+def _json_entity(content: Any) -> Tuple[bytes, str]:
+    body = orjson.dumps(content)
+    return body, f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+
+
+@lru_cache(maxsize=None)
+def _blocks_json() -> Tuple[bytes, str]:
+    return _json_entity({"blocks": get_all_blocks()})
+
+
+@lru_cache(maxsize=None)
+def _block_json(block_id: str) -> Tuple[bytes, str]:
+    return _json_entity({"block": get_block(block_id)})
+
+
+@lru_cache(maxsize=None)
+def _skill_json(block_id: str, skill_id: str) -> Tuple[bytes, str]:
+    return _json_entity({"skill": get_skill(block_id, skill_id), "block_id": block_id})
+
+
+def prime_catalog_cache() -> None:
+    _blocks_json()
+    for block_id, block in SKILL_BLOCKS.items():
+        _block_json(block_id)
+        for skill in block["skills"]:
+            _skill_json(block_id, skill["id"])
+
+
+def catalog_response(request: Request, entity: Tuple[bytes, str]) -> Response:
+    body, etag = entity
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag in (tag.strip() for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(body, media_type="application/json", headers={"ETag": etag})
+
+
 @app.get("/skills/blocks")
-async def get_skill_blocks() -> JSONResponse:
+async def get_skill_blocks(request: Request) -> Response:
     """Get all skill blocks with basic info."""
-    blocks = get_all_blocks()
-    return JSONResponse({"blocks": blocks})
+    return catalog_response(request, _blocks_json())
 
 
 @app.get("/skills/blocks/{block_id}")
-async def get_skill_block(block_id: str) -> JSONResponse:
+async def get_skill_block(block_id: str, request: Request) -> Response:
     """Get a specific block with all its skills."""
-    block = get_block(block_id)
-    if not block:
+    if not get_block(block_id):
         raise HTTPException(status_code=404, detail="Block not found")
-    return JSONResponse({"block": block})
+    return catalog_response(request, _block_json(block_id))
 
 
 @app.get("/skills/blocks/{block_id}/skills/{skill_id}")
-async def get_skill_detail(block_id: str, skill_id: str) -> JSONResponse:
+async def get_skill_detail(block_id: str, skill_id: str, request: Request) -> Response:
     """Get a specific skill with its situations."""
-    skill = get_skill(block_id, skill_id)
-    if not skill:
+    if not get_skill(block_id, skill_id):
         raise HTTPException(status_code=404, detail="Skill not found")
-    return JSONResponse({"skill": skill, "block_id": block_id})
+    return catalog_response(request, _skill_json(block_id, skill_id))
 
 
 class GenerateSituationRequest(BaseModel):
@@ -268,13 +522,10 @@ class GenerateSituationRequest(BaseModel):
 @app.post("/skills/generate-situation")
 async def generate_situation(
     request: GenerateSituationRequest,
-    settings: Settings = Depends(get_settings)
-) -> JSONResponse:
+    settings: Settings = Depends(get_settings),
+    ai: Optional[AIClient] = Depends(get_ai_client),
+) -> ORJSONResponse:
     """Generate a training situation for a skill. Returns a situation for the user to respond to."""
-    global ai_client
-    if ai_client is None:
-        ai_client = AIClient(settings, http_client)
-    
     skill = get_skill(request.block_id, request.skill_id)
     if not skill:
         raise HTTPException(status_code=404, detail="Skill not found")
@@ -285,25 +536,25 @@ async def generate_situation(
     if request.situation_index is not None and 0 <= request.situation_index < len(situations):
         situation = situations[request.situation_index]
     elif situations:
-        import random
         situation = random.choice(situations)
     else:
         # Generate with AI if no predefined situations
-        if ai_client and ai_client.enabled():
+        situation = None
+        if ai and ai.enabled():
             try:
-                situation = await ai_client.generate_skill_situation(
+                situation = await ai.generate_skill_situation(
                     skill_name=skill["name"],
                     skill_description=skill["description"],
                     theory_doc=skill.get("theory_doc", "")
                 )
             except Exception as exc:
                 logger.warning("AI situation generation failed: %s", exc)
-                situation = f"Опишите ситуацию, в которой вам нужно применить навык '{skill['name']}'. Как бы вы действовали?"
-        else:
-            situation = f"Опишите ситуацию, в которой вам нужно применить навык '{skill['name']}'. Как бы вы действовали?"
+        if situation is None:
+            situation = FALLBACK_SITUATION_TEXT.format(name=skill["name"])
     
     # Create session in database
-    session_id = SkillTrainingDB.create_session(
+    session_id = await run_db(
+        SkillTrainingDB.create_session,
         chat_id=request.chat_id,
         block_id=request.block_id,
         skill_id=request.skill_id,
@@ -311,7 +562,7 @@ async def generate_situation(
     )
     
     # Save to conversation history
-    ConversationDB.get_or_create_user(request.chat_id)
+    await run_db(ConversationDB.ensure_user, request.chat_id)
     ConversationDB.save_message(
         chat_id=request.chat_id,
         role="assistant",
@@ -320,7 +571,7 @@ async def generate_situation(
         metadata={"session_id": session_id, "block_id": request.block_id, "skill_id": request.skill_id}
     )
     
-    return JSONResponse({
+    return ORJSONResponse({
         "session_id": session_id,
         "situation": situation,
         "skill": {
@@ -341,15 +592,12 @@ class SubmitAnswerRequest(BaseModel):
 @app.post("/skills/submit-answer")
 async def submit_answer(
     request: SubmitAnswerRequest,
-    settings: Settings = Depends(get_settings)
-) -> JSONResponse:
+    settings: Settings = Depends(get_settings),
+    ai: Optional[AIClient] = Depends(get_ai_client),
+) -> ORJSONResponse:
     """Submit user's answer to a skill situation and get AI feedback."""
-    global ai_client
-    if ai_client is None:
-        ai_client = AIClient(settings, http_client)
-    
     # Get session
-    session = SkillTrainingDB.get_session(request.session_id)
+    session = await run_db(SkillTrainingDB.get_session, request.session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
@@ -375,9 +623,9 @@ async def submit_answer(
     ai_feedback = None
     score = None
     
-    if ai_client and ai_client.enabled():
+    if ai and ai.enabled():
         try:
-            feedback_result = await ai_client.evaluate_skill_answer(
+            feedback_result = await ai.evaluate_skill_answer(
                 skill_name=skill_name,
                 skill_description=skill_description,
                 situation=session["situation"],
@@ -402,8 +650,9 @@ async def submit_answer(
             ai_feedback = "Хороший развёрнутый ответ. Продолжайте практиковаться для закрепления навыка."
             score = 7
     
-    # Save answer to database
-    SkillTrainingDB.save_answer(
+    # Save answer and mark session as completed (one transaction)
+    await run_db(
+        SkillTrainingDB.submit_answer,
         session_id=request.session_id,
         chat_id=request.chat_id,
         user_answer=request.answer,
@@ -411,9 +660,6 @@ async def submit_answer(
         score=score
     )
     
-    # Mark session as completed
-    SkillTrainingDB.complete_session(request.session_id)
-    
     # Save feedback to conversation
     ConversationDB.save_message(
         chat_id=request.chat_id,
@@ -423,7 +669,7 @@ async def submit_answer(
         metadata={"session_id": request.session_id, "score": score}
     )
     
-    return JSONResponse({
+    return ORJSONResponse({
         "session_id": request.session_id,
         "feedback": ai_feedback,
         "score": score,
@@ -432,14 +678,17 @@ async def submit_answer(
 
 
 @app.get("/skills/progress/{chat_id}")
-async def get_skill_progress(chat_id: int) -> JSONResponse:
+async def get_skill_progress(chat_id: int) -> ORJSONResponse:
     """Get user's progress across all skills."""
-    progress = SkillTrainingDB.get_user_progress(chat_id)
-    sessions = SkillTrainingDB.get_user_sessions(chat_id)
+    # independent reads, served by separate pooled connections
+    progress, sessions = await asyncio.gather(
+        run_db(SkillTrainingDB.get_user_progress, chat_id),
+        run_db(SkillTrainingDB.get_user_sessions, chat_id, limit=10),
+    )
     
-    return JSONResponse({
+    return ORJSONResponse({
         "progress": progress,
-        "recent_sessions": sessions[:10]  # Last 10 sessions
+        "recent_sessions": sessions  # Last 10 sessions
     })
 
 
@@ -448,43 +697,393 @@ async def get_user_skill_sessions(
     chat_id: int,
     block_id: Optional[str] = None,
     skill_id: Optional[str] = None
-) -> JSONResponse:
+) -> ORJSONResponse:
     """Get all skill training sessions for a user."""
-    sessions = SkillTrainingDB.get_user_sessions(chat_id, block_id, skill_id)
-    return JSONResponse({"sessions": sessions})
+    sessions = await run_db(SkillTrainingDB.get_user_sessions, chat_id, block_id, skill_id)
+    return ORJSONResponse({"sessions": sessions})
 
 
 @app.get("/skills/session/{session_id}")
-async def get_skill_session_detail(session_id: int) -> JSONResponse:
+async def get_skill_session_detail(session_id: int) -> ORJSONResponse:
     """Get details of a specific skill training session including answers."""
-    session = SkillTrainingDB.get_session(session_id)
+    # answers for a missing session are just an empty list, so both reads
+    # can start before the 404 check
+    session, answers = await asyncio.gather(
+        run_db(SkillTrainingDB.get_session, session_id),
+        run_db(SkillTrainingDB.get_session_answers, session_id),
+    )
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    answers = SkillTrainingDB.get_session_answers(session_id)
     skill = get_skill(session["block_id"], session["skill_id"])
     
-    return JSONResponse({
+    return ORJSONResponse({
         "session": session,
         "answers": answers,
         "skill": skill
     })
 
 
+# ==================== INGEST HANDLERS ====================
+
+
+@dataclass
+class IngestContext:
+    """Per-request state shared by the ingest handlers."""
+
+    user: UserModel
+    event: EventModel
+    state: UserProgress
+    settings: Settings
+    # only set when AI is configured, so handlers test it once for None
+    ai: Optional[AIClient] = None
+    actions: List[Dict[str, Any]] = field(default_factory=list)
+    # set by handlers that answer early: those replies skip history and dedup
+    final: bool = False
+
+    def reply(self, text: str, keyboard: Any | None = None) -> None:
+        self.actions.append(send_message_action(chat_id=self.user.chat_id, text=text, keyboard=keyboard))
+
+
+IngestHandler = Callable[[IngestContext], Awaitable[None]]
+
+
+async def ask_sphere(ctx: IngestContext) -> None:
+    await state_store.set_sphere_pending(ctx.user.chat_id, True)
+    ctx.reply(
+        "Напиши в чат свою специальность или сферу — введи её вручную.",
+        CANCEL_ONLY_KB,
+    )
+
+
+async def ask_skill(ctx: IngestContext) -> None:
+    await state_store.set_skill_pending(ctx.user.chat_id, True)
+    ctx.reply(
+        "Напиши, что хочешь потренировать (навык/тематику) — введи вручную.",
+        CANCEL_ONLY_KB,
+    )
+
+
+async def on_start(ctx: IngestContext) -> None:
+    ctx.reply(
+        "Привет! Я помогу натренировать нужные навыки под твой запрос. Выбери, с чего начать.",
+        MAIN_MENU_KB,
+    )
+
+
+async def on_sphere_choice(ctx: IngestContext) -> None:
+    sphere_code = ctx.event.action.split("sphere:", 1)[1]
+    label = SPHERE_LABELS.get(sphere_code)
+    if label is None:
+        ctx.reply(
+            "Неизвестная сфера. Выбери из списка.",
+            SPHERE_CHOICE_KB,
+        )
+        return
+    await state_store.set_sphere(ctx.user.chat_id, sphere_code)
+    ctx.reply(
+        f"Сфера выбрана: {label}. Можно начинать диагностику или тренажёр.",
+        AFTER_SPHERE_KB,
+    )
+
+
+async def on_diagnostic_start(ctx: IngestContext) -> None:
+    chat_id = ctx.user.chat_id
+    await state_store.reset_diagnostic(chat_id)
+    ctx.state = await state_store.get(chat_id)
+    if not ctx.state.sphere_chosen:
+        await ask_sphere(ctx)
+        ctx.final = True
+        return
+    questions = await ensure_diagnostic_questions(ctx.state, ctx.settings, ctx.ai)
+    if not questions:
+        ctx.reply(
+            "Не удалось получить вопросы диагностики от AI. Попробуйте позже.",
+            MENU_ONLY_KB,
+        )
+    else:
+        ctx.actions.append(diagnostic_question_payload(0, len(questions), chat_id, questions[0]))
+
+
+async def on_training_start(ctx: IngestContext) -> None:
+    state = ctx.state
+    chat_id = ctx.user.chat_id
+    if not state.sphere_chosen:
+        await ask_sphere(ctx)
+        ctx.final = True
+        return
+    if not state.skill_chosen:
+        await ask_skill(ctx)
+        ctx.final = True
+        return
+    # если уже есть незавершённый кейс — не дублируем новый, просто напомним
+    if state.training_case_pending and state.training_cases:
+        ctx.actions.append(training_case_payload(state.skill, state.training_index, chat_id, state.training_cases))
+        ctx.final = True
+        return
+    await state_store.set_training_pending(chat_id, True)
+    state.training_index = 0
+    state.training_cases = []
+    cases = await ensure_training_cases(state, state.skill, ctx.settings, ctx.ai)
+    ctx.actions.append(training_case_payload(state.skill, 0, chat_id, cases))
+    logger.info("Start training skill=%s cases=%s", state.skill, [c[:80] for c in cases])
+
+
+async def on_section_unavailable(ctx: IngestContext) -> None:
+    # progress and table-of-contents sections are removed for now
+    ctx.reply(SECTION_UNAVAILABLE_TEXT, MENU_ONLY_KB)
+
+
+async def on_reminders_menu(ctx: IngestContext) -> None:
+    ctx.reply(
+        "Напоминания включены по запросу. Хочешь получить напоминание позже?",
+        REMINDERS_KB,
+    )
+
+
+async def on_unknown_action(ctx: IngestContext) -> None:
+    ctx.reply("Команда принята.")
+
+
+async def on_diagnostic_answer(ctx: IngestContext) -> None:
+    state = ctx.state
+    chat_id = ctx.user.chat_id
+    state.diagnostic_answers.append(ctx.event.data)
+    next_idx = len(state.diagnostic_answers)
+    questions = state.diagnostic_questions or _STATIC_DIAG_QUESTIONS
+    if next_idx < len(questions):
+        ctx.actions.append(diagnostic_question_payload(next_idx, len(questions), chat_id, questions[next_idx]))
+        return
+    state.diagnostic_done = True
+    summary = interpret_diagnostic(tuple(state.diagnostic_answers))
+    if ctx.ai is not None:
+        try:
+            summary = await ctx.ai.summarize_diagnostic(
+                questions=questions,
+                answers=state.diagnostic_answers,
+                sphere=state.sphere,
+                skill=state.skill,
+            )
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("AI diagnostic summary failed, fallback to heuristic: %s", exc)
+    ctx.reply(
+        f"Диагностика завершена.\n\n{summary}",
+        DIAG_DONE_KB,
+    )
+
+
+async def on_next_case(ctx: IngestContext) -> None:
+    state = ctx.state
+    await state_store.set_training_pending(ctx.user.chat_id, True)
+    next_idx = await state_store.increment_training(ctx.user.chat_id)
+    cases = await ensure_training_cases(state, state.skill, ctx.settings, ctx.ai)
+    ctx.actions.append(training_case_payload(state.skill, next_idx, ctx.user.chat_id, cases))
+
+
+async def on_training_restart(ctx: IngestContext) -> None:
+    state = ctx.state
+    state.training_index = 0
+    await state_store.set_training_pending(ctx.user.chat_id, True)
+    cases = await ensure_training_cases(state, state.skill, ctx.settings, ctx.ai)
+    ctx.actions.append(training_case_payload(state.skill, 0, ctx.user.chat_id, cases))
+
+
+async def on_remind_later(ctx: IngestContext) -> None:
+    ctx.reply("Хорошо, напомню позже.")
+    start_reminder(ctx.settings, ctx.user.chat_id)
+
+
+async def on_case_retry(ctx: IngestContext) -> None:
+    state = ctx.state
+    await state_store.set_training_pending(ctx.user.chat_id, True)
+    cases = await ensure_training_cases(state, state.skill, ctx.settings, ctx.ai)
+    ctx.actions.append(training_case_payload(state.skill, state.training_index, ctx.user.chat_id, cases))
+
+
+async def on_unknown_callback(ctx: IngestContext) -> None:
+    ctx.reply("Сигнал получен.")
+
+
+async def on_sphere_text(ctx: IngestContext) -> None:
+    # treat this text as sphere selection
+    await state_store.set_sphere(ctx.user.chat_id, ctx.event.text or "general")
+    ctx.reply(
+        f"Сфера установлена: {ctx.event.text}. Что дальше?",
+        AFTER_SPHERE_KB,
+    )
+    ctx.final = True
+
+
+async def on_skill_text(ctx: IngestContext) -> None:
+    chat_id = ctx.user.chat_id
+    skill_text = (ctx.event.text or "").strip() or "другой навык"
+    await state_store.set_skill(chat_id, skill_text)
+    state = ctx.state = await state_store.get(chat_id)
+    await state_store.set_training_pending(chat_id, True)
+    state.training_index = 0
+    state.training_cases = []
+    cases = await ensure_training_cases(state, state.skill, ctx.settings, ctx.ai)
+    ctx.reply("Готовлю тренинг, собираю первый кейс...")
+    if cases:
+        ctx.actions.append(training_case_payload(state.skill, 0, chat_id, cases))
+    else:
+        ctx.reply(
+            "Не удалось подготовить кейсы для этой темы. Попробуй снова или выбери другую.",
+            CANCEL_ONLY_KB,
+        )
+    logger.info("Start training after custom skill skill=%s cases=%s", state.skill, [c[:80] for c in cases])
+    ctx.final = True
+
+
+async def on_case_answer(ctx: IngestContext) -> None:
+    state = ctx.state
+    chat_id = ctx.user.chat_id
+    settings = ctx.settings
+    case_idx = state.training_index
+    cases = await ensure_training_cases(state, state.skill, settings, ctx.ai)
+    case_text = (
+        cases[case_idx]
+        if case_idx < len(cases)
+        else get_case(state.skill, case_idx)
+    )
+    if ctx.ai is not None:
+        try:
+            ai_actions = await ctx.ai.build_actions(
+                skill=state.skill,
+                sphere=state.sphere,
+                case_text=case_text,
+                user_answer=ctx.event.text or "",
+            )
+            # ensure chat_id is set and track if AI считает ответ ок
+            ai_says_next = False
+            for act in ai_actions:
+                act["chat_id"] = chat_id
+                kb = act.get("keyboard", {}) or {}
+                inline = kb.get("inline") or []
+                # only the model's own buttons can say "next"; matched by
+                # prefix like the case:next callback route
+                if not ai_says_next:
+                    ai_says_next = any(
+                        (btn.get("data") or "").startswith("case:next") for row in inline for btn in row
+                    )
+                # always add navigation buttons
+                act["keyboard"] = {"inline": inline + AI_NAV_ROWS}
+                logger.info("AI action: %s", act)
+            ctx.actions.extend(ai_actions)
+            if ai_says_next:
+                await state_store.set_training_pending(chat_id, False)
+            if not ai_actions:
+                raise RuntimeError("AI returned no actions")
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("AI client failed, fallback to heuristic: %s", exc)
+            good, feedback = evaluate_answer(ctx.event.text or "", settings)
+            ctx.reply(
+                f"{feedback}",
+                NEXT_CASE_KB if good else RETRY_KB,
+            )
+            if good:
+                await state_store.set_training_pending(chat_id, False)
+    else:
+        good, feedback = evaluate_answer(ctx.event.text or "", settings)
+        ctx.reply(
+            f"{feedback}",
+            NEXT_CASE_KB if good else RETRY_OR_MENU_KB,
+        )
+        if good:
+            await state_store.set_training_pending(chat_id, False)
+
+
+async def on_text(ctx: IngestContext) -> None:
+    state = ctx.state
+    if state.sphere_pending and not state.sphere_chosen:
+        await on_sphere_text(ctx)
+    elif state.skill_pending and not state.skill_chosen:
+        await on_skill_text(ctx)
+    elif state.training_case_pending:
+        await on_case_answer(ctx)
+    else:
+        ctx.reply(
+            "Принял сообщение. Чтобы продолжить тренировку, выбери действие в меню.",
+            IDLE_TEXT_KB,
+        )
+
+
+async def on_unknown_event(ctx: IngestContext) -> None:
+    ctx.reply("Событие принято.")
+
+
+# Exact names are looked up first, then prefixes in order.
+ACTION_HANDLERS: Dict[str, IngestHandler] = {
+    "start": on_start,
+    "menu:start": on_start,
+    "action:start": on_start,
+    "sphere:custom": ask_sphere,
+    "diagnostic:start": on_diagnostic_start,
+    "training:start": on_training_start,
+    "menu:progress": on_section_unavailable,
+    "menu:reminders": on_reminders_menu,
+    "skill:feedback": ask_skill,
+    "skill:idp": ask_skill,
+    "menu:toc": on_section_unavailable,
+}
+ACTION_PREFIX_HANDLERS: Tuple[Tuple[str, IngestHandler], ...] = (
+    ("sphere:menu", ask_sphere),
+    ("sphere:", on_sphere_choice),
+)
+# the buttons we send carry these exact values, so they resolve with one
+# dict lookup; the prefix table below only catches diag:<q>:<opt> and
+# suffixed variants from older keyboards
+CALLBACK_HANDLERS: Dict[str, IngestHandler] = {
+    "resume:yes": on_next_case,
+    "case:next": on_next_case,
+    "training:restart": on_training_restart,
+    "remind:later": on_remind_later,
+    "case:retry": on_case_retry,
+}
+CALLBACK_PREFIX_HANDLERS: Tuple[Tuple[str, IngestHandler], ...] = (
+    ("diag:", on_diagnostic_answer),
+    ("case:next", on_next_case),
+    ("training:restart", on_training_restart),
+    ("remind:later", on_remind_later),
+    ("case:retry", on_case_retry),
+)
+
+
+def find_handler(
+    name: str,
+    exact: Dict[str, IngestHandler],
+    prefixes: Tuple[Tuple[str, IngestHandler], ...],
+    default: IngestHandler,
+) -> IngestHandler:
+    handler = exact.get(name)
+    if handler is not None:
+        return handler
+    for prefix, handler in prefixes:
+        if name.startswith(prefix):
+            return handler
+    return default
+
+
 @app.post("/ingest")
-async def ingest(payload: IngestPayload, settings: Settings = Depends(get_settings)) -> JSONResponse:
-    global ingest_counter
-    global ai_client
-    if ai_client is None:
-        ai_client = AIClient(settings, http_client)
-    ingest_counter += 1
+async def ingest(
+    payload: IngestPayload,
+    settings: Settings = Depends(get_settings),
+    ai: Optional[AIClient] = Depends(get_ai_client),
+) -> ORJSONResponse:
+    with INGEST_LATENCY.time():
+        return await process_ingest(payload, settings, ai)
+
+
+async def process_ingest(payload: IngestPayload, settings: Settings, ai: Optional[AIClient]) -> ORJSONResponse:
+    etype = (payload.event.type or "").lower()
+    INGEST_REQUESTS.labels(type=etype if etype in INGEST_EVENT_TYPES else "other").inc()
     user = payload.user
     event = payload.event
     meta = payload.meta
     state = await state_store.get(user.chat_id)
 
-    # Save user to database
-    ConversationDB.get_or_create_user(user.chat_id, user.user_id, user.username)
+    # Save user to database (no write when it is already stored unchanged)
+    await run_db(ConversationDB.ensure_user, user.chat_id, user.user_id, user.username)
 
     # Save incoming message to database
     user_content = event.text or event.data or event.action or ""
@@ -497,429 +1096,25 @@ async def ingest(payload: IngestPayload, settings: Settings = Depends(get_settin
             metadata={"action": event.action, "data": event.data}
         )
 
-    actions: List[Dict[str, Any]] = []
-    etype = (event.type or "").lower()
-    data = event.data or ""
-    action_name = event.action or ""
-
+    ctx = IngestContext(
+        user=user,
+        event=event,
+        state=state,
+        settings=settings,
+        ai=ai if ai is not None and ai.enabled() else None,
+    )
     if etype == "action":
-        if action_name in ("start", "menu:start", "action:start"):
-            actions.append(
-                send_message_action(
-                    chat_id=user.chat_id,
-                    text="Привет! Я помогу натренировать нужные навыки под твой запрос. Выбери, с чего начать.",
-                    keyboard=inline_keyboard(
-                        [
-                            [{"text": "Начать диагностику", "data": "action:diagnostic:start"}],
-                            [{"text": "Перейти к тренажеру", "data": "action:training:start"}],
-                            [{"text": "Напоминания", "data": "action:menu:reminders"}],
-                            [{"text": "Сфера деятельности", "data": "action:sphere:menu"}],
-                        ]
-                    ),
-                )
-            )
-        elif action_name.startswith("sphere:menu"):
-            await state_store.set_sphere_pending(user.chat_id, True)
-            actions.append(
-                send_message_action(
-                    chat_id=user.chat_id,
-                    text="Напиши в чат свою специальность или сферу — введи её вручную.",
-                    keyboard=inline_keyboard(
-                        [
-                            [{"text": "Отмена", "data": "action:start"}],
-                        ]
-                    ),
-                )
-            )
-        elif action_name == "sphere:custom":
-            await state_store.set_sphere_pending(user.chat_id, True)
-            actions.append(
-                send_message_action(
-                    chat_id=user.chat_id,
-                    text="Напиши в чат свою специальность или сферу — введи её вручную.",
-                    keyboard=inline_keyboard(
-                        [
-                            [{"text": "Отмена", "data": "action:start"}],
-                        ]
-                    ),
-                )
-            )
-        elif action_name.startswith("sphere:"):
-            sphere_code = action_name.split("sphere:", 1)[1]
-            for code, label in SPHERES:
-                if code == sphere_code:
-                    await state_store.set_sphere(user.chat_id, code)
-                    actions.append(
-                        send_message_action(
-                            chat_id=user.chat_id,
-                            text=f"Сфера выбрана: {label}. Можно начинать диагностику или тренажёр.",
-                            keyboard=inline_keyboard(
-                                [
-                                    [{"text": "Начать диагностику", "data": "action:diagnostic:start"}],
-                                    [{"text": "Перейти к тренажёру", "data": "action:training:start"}],
-                                    [{"text": "В меню", "data": "action:start"}],
-                                ]
-                            ),
-                        )
-                    )
-                    break
-            else:
-                actions.append(
-                    send_message_action(
-                        chat_id=user.chat_id,
-                        text="Неизвестная сфера. Выбери из списка.",
-                        keyboard=inline_keyboard(
-                            [[{"text": label, "data": f"action:sphere:{code}"}] for code, label in SPHERES]
-                        ),
-                    )
-                )
-        elif action_name == "diagnostic:start":
-            await state_store.reset_diagnostic(user.chat_id)
-            state = await state_store.get(user.chat_id)
-            if not state.sphere_chosen:
-                await state_store.set_sphere_pending(user.chat_id, True)
-                actions.append(
-                    send_message_action(
-                        chat_id=user.chat_id,
-                        text="Напиши в чат свою специальность или сферу — введи её вручную.",
-                        keyboard=inline_keyboard(
-                            [
-                                [{"text": "Отмена", "data": "action:start"}],
-                            ]
-                        ),
-                    )
-                )
-                return JSONResponse({"actions": actions})
-            questions = await ensure_diagnostic_questions(state, settings, ai_client)
-            if not questions:
-                actions.append(
-                    send_message_action(
-                        chat_id=user.chat_id,
-                        text="Не удалось получить вопросы диагностики от AI. Попробуйте позже.",
-                        keyboard=inline_keyboard(
-                            [
-                                [{"text": "В меню", "data": "action:start"}],
-                            ]
-                        ),
-                    )
-                )
-            else:
-                actions.append(
-                    diagnostic_question_payload(
-                        0, len(questions), user.chat_id, questions[0]
-                    )
-                )
-        elif action_name == "training:start":
-            if not state.sphere_chosen:
-                await state_store.set_sphere_pending(user.chat_id, True)
-                actions.append(
-                    send_message_action(
-                        chat_id=user.chat_id,
-                        text="Напиши в чат свою специальность или сферу — введи её вручную.",
-                        keyboard=inline_keyboard(
-                            [
-                                [{"text": "Отмена", "data": "action:start"}],
-                            ]
-                        ),
-                    )
-                )
-                return JSONResponse({"actions": actions})
-            if not state.skill_chosen:
-                await state_store.set_skill_pending(user.chat_id, True)
-                actions.append(
-                    send_message_action(
-                        chat_id=user.chat_id,
-                        text="Напиши, что хочешь потренировать (навык/тематику) — введи вручную.",
-                        keyboard=inline_keyboard(
-                            [
-                                [{"text": "Отмена", "data": "action:start"}],
-                            ]
-                        ),
-                    )
-                )
-                return JSONResponse({"actions": actions})
-            # если уже есть незавершённый кейс — не дублируем новый, просто напомним
-            if state.training_case_pending and state.training_cases:
-                idx = state.training_index
-                actions.append(training_case_payload(state.skill, idx, user.chat_id, state.training_cases))
-                return JSONResponse({"actions": actions})
-            await state_store.set_training_pending(user.chat_id, True)
-            state.training_index = 0
-            state.training_cases = []
-            cases = await ensure_training_cases(state, state.skill, settings, ai_client)
-            actions.append(training_case_payload(state.skill, 0, user.chat_id, cases))
-            logger.info(
-                "Start training skill=%s cases=%s", state.skill, [c[:80] for c in cases]
-            )
-        elif action_name == "menu:progress":
-            # progress section removed
-            actions.append(
-                send_message_action(
-                    chat_id=user.chat_id,
-                    text="Этот раздел временно недоступен.",
-                    keyboard=inline_keyboard(
-                        [
-                            [{"text": "В меню", "data": "action:start"}],
-                        ]
-                    ),
-                )
-            )
-        elif action_name == "menu:reminders":
-            actions.append(
-                send_message_action(
-                    chat_id=user.chat_id,
-                    text="Напоминания включены по запросу. Хочешь получить напоминание позже?",
-                    keyboard=inline_keyboard(
-                        [
-                            [{"text": "Да, напомни", "data": "remind:later"}],
-                            [{"text": "Нет, продолжим", "data": "resume:yes"}],
-                        ]
-                    ),
-                )
-            )
-        elif action_name == "skill:feedback":
-            await state_store.set_skill_pending(user.chat_id, True)
-            actions.append(
-                send_message_action(
-                    chat_id=user.chat_id,
-                    text="Напиши, что хочешь потренировать (навык/тематику) — введи вручную.",
-                    keyboard=inline_keyboard(
-                        [
-                            [{"text": "Отмена", "data": "action:start"}],
-                        ]
-                    ),
-                )
-            )
-        elif action_name == "skill:idp":
-            await state_store.set_skill_pending(user.chat_id, True)
-            actions.append(
-                send_message_action(
-                    chat_id=user.chat_id,
-                    text="Напиши, что хочешь потренировать (навык/тематику) — введи вручную.",
-                    keyboard=inline_keyboard(
-                        [
-                            [{"text": "Отмена", "data": "action:start"}],
-                        ]
-                    ),
-                )
-            )
-        elif action_name == "menu:toc":
-            actions.append(
-                send_message_action(
-                    chat_id=user.chat_id,
-                    text="Этот раздел временно недоступен.",
-                    keyboard=inline_keyboard([[{"text": "В меню", "data": "action:start"}]]),
-                )
-            )
-        else:
-            actions.append(send_message_action(chat_id=user.chat_id, text="Команда принята."))
-
+        handler = find_handler(event.action or "", ACTION_HANDLERS, ACTION_PREFIX_HANDLERS, on_unknown_action)
     elif etype == "callback":
-        if data.startswith("diag:"):
-            state.diagnostic_answers.append(data)
-            next_idx = len(state.diagnostic_answers)
-            questions = state.diagnostic_questions or [
-                {"text": q["text"], "options": [opt[0] for opt in q["options"]]}
-                for q in DIAGNOSTIC_QUESTIONS
-            ]
-            if next_idx < len(questions):
-                actions.append(
-                    diagnostic_question_payload(
-                        next_idx, len(questions), user.chat_id, questions[next_idx]
-                    )
-                )
-            else:
-                state.diagnostic_done = True
-                summary = interpret_diagnostic(state.diagnostic_answers)
-                if ai_client and ai_client.enabled():
-                    try:
-                        summary = await ai_client.summarize_diagnostic(
-                            questions=questions,
-                            answers=state.diagnostic_answers,
-                            sphere=state.sphere,
-                            skill=state.skill,
-                        )
-                    except Exception as exc:  # noqa: BLE001
-                        logger.warning("AI diagnostic summary failed, fallback to heuristic: %s", exc)
-                actions.append(
-                    send_message_action(
-                        chat_id=user.chat_id,
-                        text=f"Диагностика завершена.\n\n{summary}",
-                        keyboard=inline_keyboard(
-                            [
-                                [{"text": "Перейти к тренажёру", "data": "action:training:start"}],
-                                [{"text": "Ещё раз диагностику", "data": "action:diagnostic:start"}],
-                                [{"text": "В меню", "data": "action:start"}],
-                            ]
-                        ),
-                    )
-                )
-        elif data.startswith("case:next") or data == "resume:yes":
-            await state_store.set_training_pending(user.chat_id, True)
-            next_idx = await state_store.increment_training(user.chat_id)
-            cases = await ensure_training_cases(state, state.skill, settings, ai_client)
-            actions.append(training_case_payload(state.skill, next_idx, user.chat_id, cases))
-        elif data.startswith("training:restart"):
-            state.training_index = 0
-            await state_store.set_training_pending(user.chat_id, True)
-            cases = await ensure_training_cases(state, state.skill, settings, ai_client)
-            actions.append(training_case_payload(state.skill, 0, user.chat_id, cases))
-        elif data.startswith("remind:later"):
-            actions.append(
-                send_message_action(
-                    chat_id=user.chat_id,
-                    text="Хорошо, напомню позже.",
-                )
-            )
-            asyncio.create_task(
-                schedule_reminder(settings, user.chat_id, settings.frontend_push_token)
-            )
-        elif data.startswith("case:retry"):
-            await state_store.set_training_pending(user.chat_id, True)
-            cases = await ensure_training_cases(state, state.skill, settings, ai_client)
-            actions.append(
-                training_case_payload(state.skill, state.training_index, user.chat_id, cases)
-            )
-        else:
-            actions.append(send_message_action(chat_id=user.chat_id, text="Сигнал получен."))
-
+        handler = find_handler(event.data or "", CALLBACK_HANDLERS, CALLBACK_PREFIX_HANDLERS, on_unknown_callback)
     elif etype == "text":
-        if state.sphere_pending and not state.sphere_chosen:
-            # treat this text as sphere selection
-            await state_store.set_sphere(user.chat_id, event.text or "general")
-            actions.append(
-                send_message_action(
-                    chat_id=user.chat_id,
-                    text=f"Сфера установлена: {event.text}. Что дальше?",
-                    keyboard=inline_keyboard(
-                        [
-                            [{"text": "Начать диагностику", "data": "action:diagnostic:start"}],
-                            [{"text": "Перейти к тренажёру", "data": "action:training:start"}],
-                            [{"text": "В меню", "data": "action:start"}],
-                        ]
-                    ),
-                )
-            )
-            return JSONResponse({"actions": actions})
-        if state.skill_pending and not state.skill_chosen:
-            skill_text = (event.text or "").strip() or "другой навык"
-            await state_store.set_skill(user.chat_id, skill_text)
-            state = await state_store.get(user.chat_id)
-            await state_store.set_training_pending(user.chat_id, True)
-            state.training_index = 0
-            state.training_cases = []
-            cases = await ensure_training_cases(state, state.skill, settings, ai_client)
-            actions.append(
-                send_message_action(
-                    chat_id=user.chat_id,
-                    text="Готовлю тренинг, собираю первый кейс...",
-                )
-            )
-            if cases:
-                actions.append(training_case_payload(state.skill, 0, user.chat_id, cases))
-            else:
-                actions.append(
-                    send_message_action(
-                        chat_id=user.chat_id,
-                        text="Не удалось подготовить кейсы для этой темы. Попробуй снова или выбери другую.",
-                        keyboard=inline_keyboard(
-                            [
-                                [{"text": "Отмена", "data": "action:start"}],
-                            ]
-                        ),
-                    )
-                )
-            logger.info("Start training after custom skill skill=%s cases=%s", state.skill, [c[:80] for c in cases])
-            return JSONResponse({"actions": actions})
-
-        if state.training_case_pending:
-            case_idx = state.training_index
-            cases = await ensure_training_cases(state, state.skill, settings, ai_client)
-            case_text = (
-                cases[case_idx]
-                if case_idx < len(cases)
-                else get_case(state.skill, case_idx)
-            )
-            if ai_client and ai_client.enabled():
-                try:
-                    ai_actions = await ai_client.build_actions(
-                        skill=state.skill,
-                        sphere=state.sphere,
-                        case_text=case_text,
-                        user_answer=event.text or "",
-                    )
-                    # ensure chat_id is set and track if AI считает ответ ок
-                    ai_says_next = False
-                    for act in ai_actions:
-                        act["chat_id"] = user.chat_id
-                        kb = act.get("keyboard", {}) or {}
-                        inline = kb.get("inline") or []
-                        # always add navigation buttons
-                        inline = inline + [
-                            [{"text": "В меню", "data": "action:start"}],
-                            [{"text": "Выбрать навык", "data": "action:skill:feedback"}],
-                        ]
-                        act["keyboard"] = {"inline": inline}
-                        for row in inline:
-                            for btn in row:
-                                if (btn.get("data") or "").startswith("case:next"):
-                                    ai_says_next = True
-                        logger.info("AI action: %s", act)
-                    actions.extend(ai_actions)
-                    if ai_says_next:
-                        await state_store.set_training_pending(user.chat_id, False)
-                    if not ai_actions:
-                        raise RuntimeError("AI returned no actions")
-                except Exception as exc:  # noqa: BLE001
-                    logger.warning("AI client failed, fallback to heuristic: %s", exc)
-                    good, feedback = evaluate_answer(event.text or "", settings)
-                    actions.append(
-                        send_message_action(
-                            chat_id=user.chat_id,
-                            text=f"{feedback}",
-                            keyboard=inline_keyboard(
-                                [[{"text": "Дальше", "data": "case:next"}]]
-                                if good
-                                else [[{"text": "Попробовать снова", "data": "case:retry"}]]
-                            ),
-                        )
-                    )
-                    if good:
-                        await state_store.set_training_pending(user.chat_id, False)
-            else:
-                good, feedback = evaluate_answer(event.text or "", settings)
-                actions.append(
-                    send_message_action(
-                        chat_id=user.chat_id,
-                        text=f"{feedback}",
-                        keyboard=inline_keyboard(
-                            [[{"text": "Дальше", "data": "case:next"}]]
-                            if good
-                            else [
-                                [{"text": "Попробовать снова", "data": "case:retry"}],
-                                [{"text": "В меню", "data": "action:start"}],
-                            ]
-                        ),
-                    )
-                )
-                if good:
-                    await state_store.set_training_pending(user.chat_id, False)
-        else:
-            actions.append(
-                send_message_action(
-                    chat_id=user.chat_id,
-                    text="Принял сообщение. Чтобы продолжить тренировку, выбери действие в меню.",
-                    keyboard=inline_keyboard(
-                        [
-                            [{"text": "Перейти к тренажёру", "data": "action:training:start"}],
-                            [{"text": "Прогресс", "data": "action:menu:progress"}],
-                            [{"text": "В меню", "data": "action:start"}],
-                        ]
-                    ),
-                )
-            )
+        handler = on_text
     else:
-        actions.append(send_message_action(chat_id=user.chat_id, text="Событие принято."))
+        handler = on_unknown_event
+    await handler(ctx)
+    actions = ctx.actions
+    if ctx.final:
+        return ORJSONResponse({"actions": actions})
 
     # Save bot responses to database
     for act in actions:
@@ -932,7 +1127,7 @@ async def ingest(payload: IngestPayload, settings: Settings = Depends(get_settin
                 metadata={"keyboard": act.get("keyboard")}
             )
 
-    return JSONResponse({"actions": dedup_actions(actions)})
+    return ORJSONResponse({"actions": dedup_actions(actions)})
 
 
 @app.middleware("http")
@@ -943,37 +1138,95 @@ async def add_timeout_header(request: Request, call_next):
 
 
 def dedup_actions(actions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    best_by_text: dict[tuple[str, str], Dict[str, Any]] = {}
+    """
+    Drop send_message actions repeating the text and parse mode of an earlier
+    one, preferring a copy that has a keyboard; other actions pass through.
+    Actions keep the position of their first occurrence.
+    """
+    result: List[Dict[str, Any]] = []
+    # (text, parse_mode) -> (index in result, whether that action has a keyboard)
+    seen: Dict[Tuple[str, str], Tuple[int, bool]] = {}
     for act in actions:
         if act.get("type") != "send_message":
-            # keep non-send_message actions as is
-            best_by_text.setdefault(("__other__", str(len(best_by_text))), act)
-            continue
-        text = str(act.get("text") or "")
-        parse_mode = str(act.get("parse_mode") or "HTML")
-        keyboard_raw = (
-            act.get("keyboard", {}).get("inline")
-            if isinstance(act.get("keyboard"), dict)
-            else act.get("keyboard")
-        )
-        key = (text, parse_mode)
-        existing = best_by_text.get(key)
-        has_keyboard = bool(keyboard_raw)
-        if existing is None or (has_keyboard and not existing.get("__has_keyboard")):
-            copy = dict(act)
-            copy["__has_keyboard"] = has_keyboard
-            best_by_text[key] = copy
-    result: List[Dict[str, Any]] = []
-    for key, act in best_by_text.items():
-        act.pop("__has_keyboard", None)
-        # skip placeholder keys for non-send_message
-        if key[0] == "__other__":
             result.append(act)
-        else:
+            continue
+        keyboard = act.get("keyboard")
+        has_keyboard = bool(keyboard.get("inline") if isinstance(keyboard, dict) else keyboard)
+        key = (str(act.get("text") or ""), str(act.get("parse_mode") or "HTML"))
+        existing = seen.get(key)
+        if existing is None:
+            seen[key] = (len(result), has_keyboard)
             result.append(act)
+        elif has_keyboard and not existing[1]:
+            seen[key] = (existing[0], True)
+            result[existing[0]] = act
     return result
 
 
+async def ai_warmup_loop(ai: AIClient, interval: float) -> None:
+    pairs = [(skill, code) for skill in ("feedback", "idp") for code, _ in SPHERES]
+    while True:
+        try:
+            await ai.warm(pairs)
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("AI warm-up failed: %s", exc)
+        await asyncio.sleep(interval)
+
+
+def schedule_message_flush() -> None:
+    """Flush queued messages on the db pool; save_message calls this past its high-water mark."""
+    db_pool.submit(flush_messages).add_done_callback(_log_flush_error)
+
+
+def _log_flush_error(future: Future) -> None:
+    exc = future.exception()
+    if exc is not None:
+        logger.warning("Failed to flush database writes: %s", exc)
+
+
+async def db_flush_loop() -> None:
+    while True:
+        await asyncio.sleep(DB_FLUSH_INTERVAL_SECONDS)
+        try:
+            await run_db(flush_messages)
+            state_store.flush()
+            await run_db(flush_progress)
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("Failed to flush database writes: %s", exc)
+
+
+@app.on_event("startup")
+async def startup_event():
+    global ai_client, ai_warmup_task, db_flush_task, http_client, db_pool
+    init_db()
+    db_pool = ThreadPoolExecutor(max_workers=DB_POOL_WORKERS, thread_name_prefix="db")
+    set_message_flush_scheduler(schedule_message_flush)
+    http_client = make_push_http_client()
+    prime_catalog_cache()
+    db_flush_task = asyncio.create_task(db_flush_loop())
+    settings = get_settings()
+    ai_client = AIClient(settings, ai_http_client)
+    if ai_client.enabled() and settings.ai_warmup_interval_seconds > 0:
+        ai_warmup_task = asyncio.create_task(
+            ai_warmup_loop(ai_client, settings.ai_warmup_interval_seconds)
+        )
+
+
 @app.on_event("shutdown")
 async def shutdown_event():
-    await http_client.aclose()
+    if ai_warmup_task is not None:
+        ai_warmup_task.cancel()
+    if db_flush_task is not None:
+        db_flush_task.cancel()
+    for task in list(reminder_tasks.values()):
+        task.cancel()
+    # the pool is about to go away; any further early flush runs inline
+    set_message_flush_scheduler(None)
+    flush_messages()
+    state_store.flush()
+    flush_progress()
+    if db_pool is not None:
+        db_pool.shutdown(wait=True)
+    if http_client is not None:
+        await http_client.aclose()
+    await ai_http_client.aclose()
@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import logging
+import random
+import time
+from typing import AsyncIterator, Awaitable, Callable, Optional, TypeVar
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls
+    until `reset_timeout` seconds pass; then it is half-open and lets a single
+    trial call through, rejecting the rest until that call is over.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._trial_running = False
+
+    def check(self) -> bool:
+        """
+        Raise CircuitOpenError while the circuit is open. Returns True for the
+        half-open trial call, whose caller must call end_trial() when done.
+        """
+        if self._opened_at is None:
+            return False
+        if not self._trial_running and time.monotonic() - self._opened_at >= self.reset_timeout:
+            # the failure count stays at the threshold, so one failure re-opens
+            self._trial_running = True
+            return True
+        raise CircuitOpenError(f"{self.name} circuit is open")
+
+    def end_trial(self) -> None:
+        # if the trial recorded neither outcome, the next caller gets a new one
+        self._trial_running = False
+
+    def record_success(self) -> None:
+        self._failures = 0
+        self._opened_at = None
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        if self._failures >= self.failure_threshold:
+            self._opened_at = time.monotonic()
+
+
+class BulkheadFullError(RuntimeError):
+    pass
+
+
+class Bulkhead:
+    """
+    Caps concurrent calls at `max_concurrent`. Callers wait at most
+    `max_wait` seconds for a free slot and are rejected after that, so an
+    overloaded upstream sheds load instead of queueing every request.
+    """
+
+    def __init__(self, name: str, max_concurrent: int, max_wait: float) -> None:
+        self.name = name
+        self.max_wait = max_wait
+        self._semaphore = asyncio.Semaphore(max(1, max_concurrent))
+
+    @contextlib.asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        if self._semaphore.locked():
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.max_wait)
+            except asyncio.TimeoutError:
+                raise BulkheadFullError(f"{self.name} bulkhead is full") from None
+        else:
+            await self._semaphore.acquire()
+        try:
+            yield
+        finally:
+            self._semaphore.release()
+
+
+def is_retryable(exc: Exception) -> bool:
+    """Transport errors, 429 and 5xx are worth retrying; other 4xx are not."""
+    if isinstance(exc, httpx.HTTPStatusError):
+        status = exc.response.status_code
+        return status == 429 or status >= 500
+    return isinstance(exc, httpx.TransportError)
+
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 5.0) -> float:
+    """Exponential backoff with full jitter for the given 1-based attempt."""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+async def retry_stream(
+    breaker: CircuitBreaker,
+    attempts: int,
+    start: Callable[[], AsyncIterator[T]],
+    what: str,
+    bulkhead: Optional[Bulkhead] = None,
+) -> AsyncIterator[T]:
+    """
+    Yield from start(), retrying transport errors, 429 and 5xx with jittered
+    backoff for up to `attempts` tries, but only until the first item is
+    yielded: items already handed out cannot be replayed. Retryable failures
+    that are given up on count towards opening the breaker; while it is open
+    the call fails at once. The bulkhead slot, if any, is held throughout.
+    """
+    trial = breaker.check()
+    try:
+        async with bulkhead.slot() if bulkhead is not None else contextlib.nullcontext():
+            for attempt in range(1, attempts + 1):
+                started = False
+                try:
+                    async with contextlib.aclosing(start()) as items:
+                        async for item in items:
+                            started = True
+                            yield item
+                except (httpx.HTTPStatusError, httpx.TransportError) as exc:
+                    if started or attempt == attempts or not is_retryable(exc):
+                        if is_retryable(exc):
+                            breaker.record_failure()
+                        raise
+                    logger.warning("%s failed (attempt %s): %s", what, attempt, exc)
+                    await asyncio.sleep(backoff_delay(attempt))
+                    continue
+                breaker.record_success()
+                return
+    finally:
+        if trial:
+            breaker.end_trial()
+
+
+async def call_with_retries(
+    breaker: CircuitBreaker,
+    attempts: int,
+    fn: Callable[[], Awaitable[T]],
+    what: str,
+    bulkhead: Optional[Bulkhead] = None,
+) -> T:
+    """Await fn() with the retry, breaker and bulkhead handling of retry_stream."""
+
+    async def once() -> AsyncIterator[T]:
+        yield await fn()
+
+    async with contextlib.aclosing(retry_stream(breaker, attempts, once, what, bulkhead)) as results:
+        async for result in results:
+            pass
+    return result
@@ -0,0 +1,51 @@
+from __future__ import annotations
+
+from typing import List, Optional
+
+import msgspec
+
+
+# Shapes of the JSON documents the model is asked to return. Decoders are
+# built once and validate while parsing; unknown fields are dropped.
+
+
+class Button(msgspec.Struct):
+    text: str
+    data: str = ""
+
+
+class Keyboard(msgspec.Struct):
+    inline: List[List[Button]] = []
+
+
+class Action(msgspec.Struct, omit_defaults=True):
+    # chat_id is not part of the schema: the backend always sets it itself
+    type: str
+    text: str = ""
+    parse_mode: Optional[str] = None
+    keyboard: Optional[Keyboard] = None
+
+
+class Question(msgspec.Struct):
+    question: str = ""
+    options: List[str] = []
+
+
+class DiagnosticResponse(msgspec.Struct):
+    questions: List[Question] = []
+
+
+class CasesResponse(msgspec.Struct):
+    cases: List[str] = []
+
+
+class SkillEvalResponse(msgspec.Struct):
+    score: float = 5
+    feedback: str = "Спасибо за ответ."
+
+
+action_decoder = msgspec.json.Decoder(Action)
+diagnostic_decoder = msgspec.json.Decoder(DiagnosticResponse)
+cases_decoder = msgspec.json.Decoder(CasesResponse)
+# lax mode accepts numbers sent as strings, e.g. "score": "8"
+skill_eval_decoder = msgspec.json.Decoder(SkillEvalResponse, strict=False)
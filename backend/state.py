@@ -1,11 +1,11 @@
 import asyncio
-from dataclasses import dataclass, field, asdict
-from typing import Any, Dict, List, Optional
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set
 
-from database import ProgressDB
+from database import Progress, ProgressDB
 
 
-@dataclass
+@dataclass(slots=True)
 class UserProgress:
     diagnostic_answers: List[str] = field(default_factory=list)
     diagnostic_done: bool = False
@@ -22,7 +22,39 @@ class UserProgress:
     training_cases: List[str] = field(default_factory=list)
 
     def to_dict(self) -> Dict[str, Any]:
-        return asdict(self)
+        # lists are shared, not copied: ProgressDB encodes them right away
+        return {
+            "diagnostic_answers": self.diagnostic_answers,
+            "diagnostic_done": self.diagnostic_done,
+            "training_index": self.training_index,
+            "training_case_pending": self.training_case_pending,
+            "skill": self.skill,
+            "skill_chosen": self.skill_chosen,
+            "skill_pending": self.skill_pending,
+            "sphere": self.sphere,
+            "sphere_chosen": self.sphere_chosen,
+            "sphere_pending": self.sphere_pending,
+            "last_reminder": self.last_reminder,
+            "diagnostic_questions": self.diagnostic_questions,
+            "training_cases": self.training_cases,
+        }
+
+    @classmethod
+    def from_progress(cls, progress: Progress) -> "UserProgress":
+        return cls(
+            diagnostic_answers=progress.diagnostic_answers,
+            diagnostic_done=progress.diagnostic_done,
+            training_index=progress.training_index,
+            training_case_pending=progress.training_case_pending,
+            skill=progress.skill,
+            skill_chosen=progress.skill_chosen,
+            skill_pending=progress.skill_pending,
+            sphere=progress.sphere,
+            sphere_chosen=progress.sphere_chosen,
+            sphere_pending=progress.sphere_pending,
+            diagnostic_questions=progress.diagnostic_questions,
+            training_cases=progress.training_cases,
+        )
 
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> "UserProgress":
@@ -43,24 +75,41 @@ class UserProgress:
         )
 
 
+# chats hash onto a fixed set of locks, so one chat waiting on a database
+# load does not hold up the others
+STATE_LOCK_STRIPES = 256
+
+
 class StateStore:
     def __init__(self) -> None:
         self._store: Dict[int, UserProgress] = {}
-        self._lock = asyncio.Lock()
+        self._locks = [asyncio.Lock() for _ in range(STATE_LOCK_STRIPES)]
+        # chats changed since the last flush(); snapshotted there, so several
+        # mutations in one request cost a single to_dict() and encode
+        self._dirty: Set[int] = set()
 
     async def _save_to_db(self, chat_id: int, state: UserProgress) -> None:
-        """Persist state to database."""
-        ProgressDB.save_progress(chat_id, state.to_dict())
+        """Mark state for the next flush(); nothing is written here."""
+        self._dirty.add(chat_id)
+
+    def _lock_for(self, chat_id: int) -> asyncio.Lock:
+        return self._locks[chat_id % STATE_LOCK_STRIPES]
+
+    def flush(self) -> None:
+        """Hand changed states to ProgressDB; flush_progress() then writes them."""
+        dirty, self._dirty = self._dirty, set()
+        for chat_id in dirty:
+            ProgressDB.save_progress(chat_id, self._store[chat_id].to_dict())
 
     async def _load_from_db(self, chat_id: int) -> Optional[UserProgress]:
-        """Load state from database."""
-        data = ProgressDB.get_progress(chat_id)
-        if data:
-            return UserProgress.from_dict(data)
+        """Load state from database, off the event loop (a miss reads SQLite)."""
+        progress = await asyncio.to_thread(ProgressDB.get_progress, chat_id)
+        if progress:
+            return UserProgress.from_progress(progress)
         return None
 
     async def get(self, chat_id: int) -> UserProgress:
-        async with self._lock:
+        async with self._lock_for(chat_id):
             if chat_id not in self._store:
                 # Try to load from database first
                 db_state = await self._load_from_db(chat_id)
@@ -71,7 +120,7 @@ class StateStore:
             return self._store[chat_id]
 
     async def reset_diagnostic(self, chat_id: int) -> None:
-        async with self._lock:
+        async with self._lock_for(chat_id):
             state = self._store.setdefault(chat_id, UserProgress())
             state.diagnostic_answers = []
             state.diagnostic_done = False
@@ -79,7 +128,7 @@ class StateStore:
             await self._save_to_db(chat_id, state)
 
     async def increment_training(self, chat_id: int) -> int:
-        async with self._lock:
+        async with self._lock_for(chat_id):
             state = self._store.setdefault(chat_id, UserProgress())
             state.training_index += 1
             state.training_case_pending = True
@@ -87,7 +136,7 @@ class StateStore:
             return state.training_index
 
     async def set_skill(self, chat_id: int, skill: str) -> None:
-        async with self._lock:
+        async with self._lock_for(chat_id):
             state = self._store.setdefault(chat_id, UserProgress())
             state.skill = skill
             state.skill_chosen = True
@@ -98,13 +147,13 @@ class StateStore:
             await self._save_to_db(chat_id, state)
 
     async def set_skill_pending(self, chat_id: int, pending: bool) -> None:
-        async with self._lock:
+        async with self._lock_for(chat_id):
             state = self._store.setdefault(chat_id, UserProgress())
             state.skill_pending = pending
             await self._save_to_db(chat_id, state)
 
     async def set_sphere(self, chat_id: int, sphere: str) -> None:
-        async with self._lock:
+        async with self._lock_for(chat_id):
             state = self._store.setdefault(chat_id, UserProgress())
             state.sphere = sphere
             state.sphere_chosen = True
@@ -113,7 +162,7 @@ class StateStore:
             await self._save_to_db(chat_id, state)
 
     async def set_sphere_pending(self, chat_id: int, pending: bool) -> None:
-        async with self._lock:
+        async with self._lock_for(chat_id):
             state = self._store.setdefault(chat_id, UserProgress())
             state.sphere_pending = pending
             if pending:
@@ -124,7 +173,7 @@ class StateStore:
             await self._save_to_db(chat_id, state)
 
     async def set_training_pending(self, chat_id: int, pending: bool) -> None:
-        async with self._lock:
+        async with self._lock_for(chat_id):
             state = self._store.setdefault(chat_id, UserProgress())
             state.training_case_pending = pending
             await self._save_to_db(chat_id, state)
@@ -1,7 +1,9 @@
 from __future__ import annotations
 
 import asyncio
+import json
 import logging
+import random
 from typing import Any
 
 import aiohttp
@@ -9,6 +11,9 @@ import aiohttp
 
 logger = logging.getLogger(__name__)
 
+RETRY_BASE_DELAY = 0.2
+RETRY_MAX_DELAY = 2.0
+
 
 class BackendClient:
     def __init__(
@@ -24,32 +29,38 @@ class BackendClient:
         self._session = session
         self._timeout = aiohttp.ClientTimeout(total=timeout_seconds)
         self._retries = retries
+        self._headers = {"Content-Type": "application/json"}
+        if token:
+            self._headers["Authorization"] = f"Bearer {token}"
 
     async def send_event(self, payload: dict[str, Any]) -> dict[str, Any]:
         url = f"{self.base_url}/ingest"
-        headers = {"Content-Type": "application/json"}
-        if self._token:
-            headers["Authorization"] = f"Bearer {self._token}"
-
         attempt = 0
         last_error: Exception | None = None
         while attempt <= self._retries:
             try:
                 async with self._session.post(
-                    url, json=payload, headers=headers, timeout=self._timeout
+                    url, json=payload, headers=self._headers, timeout=self._timeout
                 ) as resp:
-                    text = await resp.text()
+                    # the body is decoded to text only for error messages
+                    body = await resp.read()
                     if resp.status >= 400:
+                        text = body.decode("utf-8", "replace")
                         raise RuntimeError(f"backend error {resp.status}: {text}")
                     try:
-                        return await resp.json()
-                    except Exception as exc:  # noqa: BLE001
+                        return json.loads(body)
+                    except ValueError as exc:
+                        text = body.decode("utf-8", "replace")
                         raise RuntimeError(f"invalid backend JSON: {text}") from exc
             except (aiohttp.ClientError, asyncio.TimeoutError, RuntimeError) as exc:
                 last_error = exc
                 attempt += 1
                 logger.warning("backend request failed (attempt %s): %s", attempt, exc)
-                await asyncio.sleep(0.2 * attempt)
+                if attempt <= self._retries:
+                    # exponential backoff with full jitter, so chats retrying
+                    # after the same hiccup do not hit the backend together
+                    delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1))
+                    await asyncio.sleep(random.uniform(0, delay))
 
         assert last_error is not None
         raise last_error
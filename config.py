@@ -11,7 +11,8 @@ def _getenv(name: str) -> str:
     return os.getenv(name, "").strip()
 
 
-@dataclass
+# read once at startup and never changed afterwards
+@dataclass(frozen=True, slots=True)
 class Settings:
     bot_token: str = field(default_factory=lambda: _getenv("BOT_TOKEN"))
     backend_url: str = field(default_factory=lambda: _getenv("BACKEND_URL"))
@@ -1,20 +1,37 @@
 from __future__ import annotations
 
+from functools import lru_cache
 from typing import Any
 
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 
+# the backend sends a small, fixed set of layouts, so one markup instance per
+# layout is shared by every message. aiogram 3.4 markups are NOT frozen: callers
+# must never mutate what build_keyboard returns, or the change leaks into every
+# chat that gets the same layout
+KEYBOARD_CACHE_SIZE = 256
+
 
 def build_keyboard(raw_keyboard: Any | None) -> InlineKeyboardMarkup | None:
     if not raw_keyboard:
         return None
 
+    rows_key = tuple(
+        tuple(
+            (str(item.get("text") or "").strip(), item.get("callback_data") or item.get("data") or "")
+            for item in row
+        )
+        for row in raw_keyboard
+    )
+    return _build_markup(rows_key)
+
+
+@lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+def _build_markup(rows_key: tuple[tuple[tuple[str, Any], ...], ...]) -> InlineKeyboardMarkup | None:
     rows: list[list[InlineKeyboardButton]] = []
-    for row in raw_keyboard:
+    for row in rows_key:
         buttons: list[InlineKeyboardButton] = []
-        for item in row:
-            text = str(item.get("text") or "").strip()
-            callback_data = item.get("callback_data") or item.get("data") or ""
+        for text, callback_data in row:
             if not text:
                 continue
             buttons.append(InlineKeyboardButton(text=text, callback_data=callback_data))
@@ -507,7 +507,11 @@ async def main() -> None:
         settings.bot_token, default=DefaultBotProperties(parse_mode=ParseMode.HTML)
     )
     dp = Dispatcher()
-    session = aiohttp.ClientSession()
+    # shared by the backend client and the transcriber; keep-alive
+    # connections are reused across updates
+    session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=200, limit_per_host=100, keepalive_timeout=60)
+    )
     backend_client = BackendClient(
         base_url=settings.backend_url,
         token=settings.backend_token,